@@ -5,9 +5,17 @@ Created on May 5, 2013
 
 A set of functions to analyze model output files.
 '''
+import csv
 import json
 import os
+import re
+import mmap
 import exceptions
+import time
+import traceback
+import warnings
+from multiprocessing import Pool
+import numpy as np
 import networkx as nx
 
 OUTPUT_PATH = "../outputs/"
@@ -53,6 +61,29 @@ def load_data(path):
     data = recode_dict(data_raw)
     return data
 
+def load_arrays(run_path, mmap_mode='r'):
+    '''
+    Load the arrays a run exported with output_format "arrays" or "both".
+    
+    Args:
+        run_path: The run's output directory.
+        mmap_mode: Passed to np.load; by default the arrays are memory-mapped
+            read-only, so only the parts actually used are read from disk. 
+            Set to None to read them into memory in full.
+    
+    Returns:
+        A dictionary mapping each array name (see 
+        DataCollector.write_arrays) to the array.
+    '''
+    array_path = os.path.join(run_path, "arrays")
+    arrays = {}
+    for filename in os.listdir(array_path):
+        name, ext = os.path.splitext(filename)
+        if ext == ".npy":
+            arrays[name] = np.load(os.path.join(array_path, filename),
+                                   mmap_mode=mmap_mode)
+    return arrays
+
 def iterate_over_data(base_path):
     '''
     Iterate over data files, loading and yielding one at a time.
@@ -64,6 +95,250 @@ def iterate_over_data(base_path):
             pass
 
 
+
+'''
+LAZY RUN ACCESS
+===============
+'''
+
+def list_runs(base_path=OUTPUT_PATH):
+    '''
+    List handles on all the runs under the given output path.
+    '''
+    runs = []
+    for run_dir in sorted(os.listdir(base_path)):
+        run_path = os.path.join(base_path, run_dir)
+        if os.path.exists(os.path.join(run_path, "config.json")):
+            runs.append(Run(run_path))
+    return runs
+
+
+class Run(object):
+    '''
+    A lazy handle on a run's output directory.
+    
+    Nothing beyond the directory listing is read until it is asked for, and
+    then only what is needed:
+        - The config is read from config.json on first access.
+        - Variables in data.json are read by seeking to each requested
+          timestamp's value, using the byte offsets in data.index.json; for
+          runs without an index, it is built by scanning the file once and
+          saved for next time.
+        - Runs that only have a data.ndjson stream (e.g. because they were
+          stopped before exporting) are read by replaying the deltas in it.
+        - Arrays exported with the "arrays" output format are memory-mapped.
+    
+    Attributes:
+        path: The run's output directory.
+        run_id: The name of the directory; the run's uuid.
+    '''
+    
+    def __init__(self, path):
+        self.path = path
+        self.run_id = os.path.basename(os.path.normpath(path))
+        self._config = None
+        self._index = None
+        self._stream_index = None
+        self._arrays = None
+    
+    def __repr__(self):
+        return "Run(%r)" % self.path
+    
+    @property
+    def config(self):
+        if self._config is None:
+            with open(os.path.join(self.path, "config.json")) as f:
+                self._config = json.load(f)
+        return self._config
+    
+    def has(self, filename):
+        return os.path.exists(os.path.join(self.path, filename))
+    
+    def array(self, name):
+        '''
+        Get a memory-mapped array exported with the "arrays" output format.
+        '''
+        if self._arrays is None:
+            self._arrays = load_arrays(self.path)
+        return self._arrays[name]
+    
+    def timestamps(self):
+        '''
+        Get the list of collection timestamps in the run.
+        '''
+        if self.has("data.json"):
+            return self._get_index()["timestamps"]
+        return [timestamp for timestamp, offset in self._get_stream_index()]
+    
+    def get(self, var, start=None, stop=None):
+        '''
+        Get the values of a variable over a slice of the run's timestamps.
+        
+        Args:
+            var: "wealth", "tasks", "task_counts" or "willingness_to_help"
+            start, stop: Indices into timestamps(), as in a slice.
+        
+        Returns:
+            A dictionary of {timestamp: value}, with values as load_data()
+            would give them.
+        '''
+        if self.has("data.json"):
+            return self._get_from_json(var, start, stop)
+        data = self._get_from_stream([var], start, stop)
+        return dict((timestamp, state[var])
+                    for timestamp, state in data.iteritems())
+    
+    def load(self, variables, start=None, stop=None):
+        '''
+        Load a subset of the data, shaped like load_data()'s output:
+            {timestamp: {var: value, ...}}
+        so that it can be passed to the analysis functions.
+        
+        Runs with only a data.ndjson stream are replayed once for all the
+        variables.
+        '''
+        if not self.has("data.json"):
+            return self._get_from_stream(variables, start, stop)
+        data = {}
+        for var in variables:
+            for timestamp, value in self.get(var, start, stop).iteritems():
+                data.setdefault(timestamp, {})[var] = value
+        return data
+    
+    def _get_index(self):
+        if self._index is None:
+            index_path = os.path.join(self.path, "data.index.json")
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    self._index = json.load(f)
+            else:
+                self._index = index_json(os.path.join(self.path, "data.json"))
+                with open(index_path, "wb") as f:
+                    json.dump(self._index, f)
+        return self._index
+    
+    def _get_from_json(self, var, start, stop):
+        index = self._get_index()
+        timestamps = index["timestamps"][start:stop]
+        offsets = index["offsets"][var][start:stop]
+        values = {}
+        with open(os.path.join(self.path, "data.json"), "rb") as f:
+            data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for timestamp, (begin, end) in zip(timestamps, offsets):
+                value = json.loads(data_map[begin:end])
+                if type(value) is dict:
+                    value = recode_dict(value)
+                values[timestamp] = value
+            data_map.close()
+        return values
+    
+    def _get_stream_index(self):
+        '''
+        List the (timestamp, byte offset) of each record in data.ndjson.
+        '''
+        if self._stream_index is None:
+            self._stream_index = []
+            with open(os.path.join(self.path, "data.ndjson"), "rb") as f:
+                offset = 0
+                for line in f:
+                    if line.endswith("\n"): # Skip a partly-written last line
+                        timestamp = json.loads(line)["timestamp"]
+                        self._stream_index.append((timestamp, offset))
+                    offset += len(line)
+        return self._stream_index
+    
+    def _get_from_stream(self, variables, start, stop):
+        '''
+        Replay data.ndjson once, and get the values of the given variables
+        over a slice of its timestamps, as {timestamp: {var: value, ...}}.
+        '''
+        stream_index = self._get_stream_index()
+        selected = range(len(stream_index))[start:stop]
+        if not selected:
+            return {}
+        first_selected, last_selected = selected[0], selected[-1]
+        values = {}
+        states = {}
+        for var in variables:
+            states[var] = {}
+        if "willingness_to_help" in states:
+            # Every agent has an entry, even before it has any WTH values
+            for agent_id in range(self.config["agent_count"]):
+                states["willingness_to_help"][str(agent_id)] = {}
+        with open(os.path.join(self.path, "data.ndjson"), "rb") as f:
+            # Deltas have to be applied from the start, up to the last one
+            # requested; except for task_counts, which are never deltas.
+            if all(var == "task_counts" for var in variables):
+                first = first_selected
+            else:
+                first = 0
+            f.seek(stream_index[first][1])
+            for i in range(first, last_selected + 1):
+                record = json.loads(f.readline())
+                for var in variables:
+                    delta = record[var]
+                    state = states[var]
+                    if var == "task_counts":
+                        states[var] = delta
+                    elif var == "willingness_to_help" and "source" in delta:
+                        # Sparse (source, target, value) triplets
+                        for agent_id, neighbor, wth in zip(delta["source"],
+                                                           delta["target"],
+                                                           delta["value"]):
+                            state.setdefault(str(agent_id),
+                                             {})[str(neighbor)] = wth
+                    elif var == "willingness_to_help":
+                        # Older streams, with nested dictionaries
+                        for agent_id, entries in delta.iteritems():
+                            state.setdefault(agent_id, {}).update(entries)
+                    else:
+                        state.update(delta)
+                if i >= first_selected:
+                    values[stream_index[i][0]] = dict(
+                        (var, recode_dict(states[var])) for var in variables)
+        return values
+
+
+def index_json(path):
+    '''
+    Scan a data.json file, and find the byte offsets of each variable's value
+    at each timestamp, in the format of the .index.json files that 
+    DataCollector.write_json writes.
+    '''
+    with open(path, "rb") as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[ \t\n\r]*')
+    def skip(pos, char=None):
+        pos = whitespace.match(text, pos).end()
+        if char is not None and text[pos] == char:
+            pos = whitespace.match(text, pos + 1).end()
+        return pos
+    
+    entries = []
+    pos = skip(skip(0), "{")
+    while text[pos] != "}":
+        timestamp, pos = decoder.raw_decode(text, pos)
+        pos = skip(skip(pos, ":"), "{")
+        offsets = {}
+        while text[pos] != "}":
+            var, pos = decoder.raw_decode(text, pos)
+            pos = skip(pos, ":")
+            value, end = decoder.raw_decode(text, pos)
+            offsets[var] = (pos, end)
+            pos = skip(end, ",")
+        pos = skip(pos + 1, ",")
+        entries.append((to_num(timestamp), offsets))
+    
+    entries.sort()
+    index = {"timestamps": [timestamp for timestamp, offsets in entries],
+             "offsets": {}}
+    for timestamp, offsets in entries:
+        for var, offset in offsets.iteritems():
+            index["offsets"].setdefault(var, []).append(offset)
+    return index
+
+
 '''
 ANALYSIS FUNCTIONS
 ==================
@@ -109,33 +384,244 @@ def get_ginis(data):
         ginis.append(gini)
     return ginis
 
+def wealth_matrix(data):
+    '''
+    Convert the wealth in load_data()-shaped data to a matrix.
+    
+    Returns:
+        (timestamps, agent_ids, wealth), where wealth is a (T, N) array with
+        a row per timestamp and a column per agent id, in sorted order. An
+        agent with no wealth recorded at a timestamp gets 0 there, as in
+        the "arrays" output format.
+    '''
+    timestamps = sorted(data.keys())
+    agent_ids = set()
+    for key in timestamps:
+        agent_ids.update(data[key]["wealth"])
+    agent_ids = sorted(agent_ids)
+    columns = dict((agent_id, i) for i, agent_id in enumerate(agent_ids))
+    wealth = np.zeros((len(timestamps), len(agent_ids)))
+    for t, key in enumerate(timestamps):
+        for agent_id, value in data[key]["wealth"].iteritems():
+            wealth[t, columns[agent_id]] = value
+    return timestamps, agent_ids, wealth
+
+def task_table(data):
+    '''
+    Convert the tasks in load_data()-shaped data to a task state table.
+    
+    Returns:
+        (task_ids, created, completed): aligned arrays of each task's id, the
+        index of the first timestamp it appears at, and the index of the 
+        first timestamp it is no longer active at, or -1 if it never 
+        finishes. These are the task_id, task_created and task_completed 
+        arrays of the "arrays" output format.
+    '''
+    created = {}
+    completed = {}
+    for t, key in enumerate(sorted(data.keys())):
+        for task_id, task in data[key]["tasks"].iteritems():
+            if task_id not in created:
+                created[task_id] = t
+            if not task['active'] and task_id not in completed:
+                completed[task_id] = t
+    task_ids = sorted(created)
+    return (np.array(task_ids, dtype=np.int64),
+            np.array([created[task_id] for task_id in task_ids], 
+                     dtype=np.int64),
+            np.array([completed.get(task_id, -1) for task_id in task_ids], 
+                     dtype=np.int64))
+
+def get_ginis_array(wealth):
+    '''
+    Vectorized get_ginis: the gini coefficient of each row of a (T, N) 
+    wealth matrix, such as the one from wealth_matrix().
+    '''
+    wealth = np.sort(np.asarray(wealth, dtype=np.float64), axis=1)
+    n = wealth.shape[1]
+    if n == 0:
+        return np.zeros(wealth.shape[0])
+    sum_iy = wealth.dot(np.arange(n, dtype=np.float64))
+    sum_y = wealth.sum(axis=1)
+    ginis = np.zeros(wealth.shape[0])
+    positive = sum_y > 0
+    ginis[positive] = ((2.0 * sum_iy[positive]) / (n * sum_y[positive]) 
+                       - ((n + 1.0) / n))
+    return ginis
+
+def count_tasks_array(created, completed, n_timestamps):
+    '''
+    Vectorized count_tasks, from a task state table such as the one from 
+    task_table().
+    
+    Args:
+        created, completed: Timestamp index of each task's creation and 
+            completion, -1 if never completed.
+        n_timestamps: The number of timestamps in the run.
+    
+    Returns:
+        (active_tasks, complete_tasks), arrays of the number of tasks
+        active and complete at each timestamp index.
+    '''
+    created = np.asarray(created)
+    completed = np.asarray(completed)
+    created_count = np.cumsum(np.bincount(created, minlength=n_timestamps))
+    completed = completed[completed >= 0]
+    complete_tasks = np.cumsum(np.bincount(completed, 
+                                           minlength=n_timestamps))
+    active_tasks = created_count - complete_tasks
+    return active_tasks[:n_timestamps], complete_tasks[:n_timestamps]
+
+
+'''
+BATCH SUMMARIES
+===============
+'''
+
+SUMMARY_COLUMNS = ["run_id", "timestamp", "gini", "total_wealth", 
+                   "active_tasks", "complete_tasks"]
+
+# The outputs a run can be summarized from, in load_summary_arrays().
+SUMMARY_SOURCES = ["arrays", "data.json", "data.ndjson"]
+
+def load_summary_arrays(run):
+    '''
+    Get the wealth matrix and task table of a run: memory-mapped from its 
+    arrays if it has them, or else converted from its data.json or 
+    data.ndjson.
+    
+    Args:
+        run: A Run, or the path to a run's output directory.
+    
+    Returns:
+        (timestamps, wealth, created, completed), as from wealth_matrix() and
+        task_table().
+    '''
+    if not isinstance(run, Run):
+        run = Run(run)
+    if run.has("arrays"):
+        return (run.array("timestamps").tolist(), run.array("wealth"),
+                run.array("task_created"), run.array("task_completed"))
+    data = run.load(["wealth", "tasks"])
+    timestamps, agent_ids, wealth = wealth_matrix(data)
+    task_ids, created, completed = task_table(data)
+    return timestamps, wealth, created, completed
+
+def summarize_run(run):
+    '''
+    Compute the summary statistics of one run, at every timestamp at once.
+    
+    Returns:
+        A dictionary mapping each of SUMMARY_COLUMNS except run_id to an 
+        array with an entry per timestamp.
+    '''
+    timestamps, wealth, created, completed = load_summary_arrays(run)
+    active_tasks, complete_tasks = count_tasks_array(created, completed,
+                                                     len(timestamps))
+    return {"timestamp": np.asarray(timestamps),
+            "gini": get_ginis_array(wealth),
+            "total_wealth": np.asarray(wealth).sum(axis=1),
+            "active_tasks": active_tasks,
+            "complete_tasks": complete_tasks}
+
+def summarize_runs(base_path=OUTPUT_PATH, filepath=None, config_keys=()):
+    '''
+    Summarize every run under an output directory into one csv table, with
+    a row per run per timestamp.
+    
+    Runs with no data yet (e.g. ones that crashed before exporting, leaving
+    only their config and checkpoint) are skipped, as are runs that fail to
+    load or summarize; a warning is issued for each.
+    
+    Args:
+        base_path: Directory holding the runs' output directories.
+        filepath: Where to write the table; defaults to summary.csv in 
+            base_path.
+        config_keys: Config parameters to add as columns, e.g. the ones a
+            sweep varied.
+    
+    Returns:
+        The path the table was written to.
+    '''
+    if filepath is None:
+        filepath = os.path.join(base_path, "summary.csv")
+    config_keys = list(config_keys)
+    with open(filepath, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS + config_keys)
+        for run in list_runs(base_path):
+            if not any(run.has(name) for name in SUMMARY_SOURCES):
+                warnings.warn("Skipping %s: it has no data" % run.run_id)
+                continue
+            try:
+                summary = summarize_run(run)
+            except Exception:
+                warnings.warn("Summary of %s failed:\n%s" %
+                              (run.run_id, traceback.format_exc()))
+                continue
+            config = [run.config.get(key) for key in config_keys]
+            columns = [summary[col] for col in SUMMARY_COLUMNS[1:]]
+            for row in zip(*columns):
+                writer.writerow([run.run_id] + list(row) + config)
+    return filepath
+
 
 '''
 NETWORK ANALYSIS FUNCTIONS
 '''
 
+NETWORK_FILE = "last_task_graph.graphml"
+
 def iterate_over_networks(base_path):
     '''
     Iterate over network files, loading and yielding one at a time.
+    
+    Runs without a network file are skipped; networks that fail to load are
+    skipped with a warning.
     '''
     for run_dir in os.listdir(base_path):
+        graph_path = os.path.join(base_path, run_dir, NETWORK_FILE)
+        if not os.path.exists(graph_path):
+            continue
         try:
-            yield nx.read_graphml(base_path + run_dir + "/last_task_graph.graphml")
-        except:
-            pass
+            yield nx.read_graphml(graph_path)
+        except Exception as e:
+            warnings.warn("Could not load %s: %s" % (graph_path, e))
+
+
+def betweenness_centrality(G, k=None, seed=None):
+    '''
+    Betweenness centrality of each node.
+    
+    Args:
+        k: If not None, approximate it from the shortest paths from only k
+            sampled nodes, rather than all of them; much faster on large
+            graphs.
+        seed: Random seed for the sample.
+    '''
+    if k is not None and k >= len(G):
+        k = None
+    return nx.betweenness_centrality(G, k=k, seed=seed)
 
 
-def get_agent_data(G):
+def get_agent_data(G, closeness=None, betweenness=None):
     '''
     Get the agent attributes and stats loaded from a model output graph.
+    
+    Args:
+        G: The graph.
+        closeness, betweenness: Precomputed centralities, if already 
+            available; otherwise they are computed here.
 
     Returns a list of dictionaries.
     '''
     agent_count = len(G)
     agent_data = []
 
-    betweenness = nx.betweenness_centrality(G)
-    closeness = nx.closeness_centrality(G)
+    if betweenness is None:
+        betweenness = betweenness_centrality(G)
+    if closeness is None:
+        closeness = nx.closeness_centrality(G)
     for node, params in G.nodes(data=True):
         node_data = params
         node_data['in_deg'] = G.in_degree(node)
@@ -147,7 +633,7 @@ def get_agent_data(G):
     return agent_data
 
 
-def get_network_statistics(G):
+def get_network_statistics(G, closeness=None):
     '''
     Compute key nework statistics for 
     '''
@@ -155,9 +641,10 @@ def get_network_statistics(G):
     density = nx.density(G)
     #diameter = nx.diameter(G)
 
-    clustering = nx.average_clustering(G.to_undirected())
-    transitivity = nx.transitivity(G.to_undirected())
-    grc = global_reaching_centrality(G)
+    undirected = G.to_undirected()
+    clustering = nx.average_clustering(undirected)
+    transitivity = nx.transitivity(undirected)
+    grc = global_reaching_centrality(G, closeness)
     return {"size": size,
             "density": density,
             #"diameter": diameter,
@@ -169,16 +656,145 @@ def get_network_statistics(G):
 
 
 
-def global_reaching_centrality(G):
+def global_reaching_centrality(G, closeness=None):
     '''
     Compute the Global Reaching Centrality measure of heirarchy.
     
+    Args:
+        G: The graph.
+        closeness: Its closeness centrality, if already computed.
     '''
-
-    reaching_scores = nx.closeness_centrality(G).values()
+    if closeness is None:
+        closeness = nx.closeness_centrality(G)
+    reaching_scores = closeness.values()
     cr_max = max(reaching_scores)
     grc = 0
     for cr in reaching_scores:
         grc += (cr_max - cr)
     grc = grc / (len(reaching_scores) - 1.0)
-    return grc
\ No newline at end of file
+    return grc
+
+
+def analyze_network(G, k=None, seed=None):
+    '''
+    Compute the agent data and network statistics of a graph, computing the
+    closeness centrality that both use only once.
+    
+    Args:
+        G: The graph.
+        k, seed: Betweenness sampling, as in betweenness_centrality().
+    
+    Returns:
+        (agent_data, statistics), as from get_agent_data() and 
+        get_network_statistics().
+    '''
+    closeness = nx.closeness_centrality(G)
+    betweenness = betweenness_centrality(G, k, seed)
+    agent_data = get_agent_data(G, closeness, betweenness)
+    statistics = get_network_statistics(G, closeness)
+    return agent_data, statistics
+
+
+'''
+NETWORK PIPELINE
+================
+'''
+
+NETWORK_COLUMNS = ["run_id", "status", "elapsed", "error", "size", 
+                   "density", "clustering", "transitivity", "grc"]
+
+def analyze_run_network(args):
+    '''
+    Load and analyze one run's network, in a worker process.
+    
+    Args:
+        args: (run_path, k, seed), as a tuple for Pool.imap_unordered.
+    
+    Returns:
+        A result dictionary with the run_id, status ("done" or "failed"), 
+        elapsed time, error traceback if it failed, and its "statistics" and
+        "agent_data" if it didn't.
+    '''
+    run_path, k, seed = args
+    result = {"run_id": os.path.basename(os.path.normpath(run_path)),
+              "status": "done", "elapsed": 0, "error": ""}
+    start = time.time()
+    try:
+        G = nx.read_graphml(os.path.join(run_path, NETWORK_FILE))
+        result["agent_data"], result["statistics"] = analyze_network(G, k,
+                                                                     seed)
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    result["elapsed"] = time.time() - start
+    return result
+
+
+def analyze_networks(base_path=OUTPUT_PATH, filepath=None, 
+                     agent_filepath=None, k=None, seed=None, processes=None):
+    '''
+    Analyze the networks of every run under an output directory in parallel,
+    into one csv table with a row per run.
+    
+    Runs that failed to load or analyze still get a row, with status
+    "failed" and the error, and a warning is issued for each as it happens.
+    
+    Args:
+        base_path: Directory holding the runs' output directories.
+        filepath: Where to write the table; defaults to network_stats.csv in
+            base_path.
+        agent_filepath: If not None, also write the agent data of all the
+            runs to this csv, with a row per agent per run.
+        k, seed: Betweenness sampling, as in betweenness_centrality().
+        processes: Number of worker processes; defaults to the CPU count.
+    
+    Returns:
+        A dictionary mapping each run_id to its result (see 
+        analyze_run_network()).
+    '''
+    if filepath is None:
+        filepath = os.path.join(base_path, "network_stats.csv")
+    run_paths = [os.path.join(base_path, run_dir) 
+                 for run_dir in sorted(os.listdir(base_path))
+                 if os.path.exists(os.path.join(base_path, run_dir, 
+                                                NETWORK_FILE))]
+    results = {}
+    pool = Pool(processes)
+    try:
+        for result in pool.imap_unordered(analyze_run_network,
+                                          [(run_path, k, seed) 
+                                           for run_path in run_paths]):
+            results[result["run_id"]] = result
+            if result["status"] == "failed":
+                warnings.warn("Network analysis of %s failed:\n%s" %
+                              (result["run_id"], result["error"]))
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+    
+    with open(filepath, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(NETWORK_COLUMNS)
+        for run_id in sorted(results):
+            result = results[run_id]
+            statistics = result.get("statistics", {})
+            writer.writerow([result[col] for col in NETWORK_COLUMNS[:4]] +
+                            [statistics.get(col, "") 
+                             for col in NETWORK_COLUMNS[4:]])
+    
+    if agent_filepath is not None:
+        columns = []
+        for result in results.values():
+            for node_data in result.get("agent_data", []):
+                for col in node_data:
+                    if col not in columns:
+                        columns.append(col)
+        with open(agent_filepath, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(["run_id"] + columns)
+            for run_id in sorted(results):
+                for node_data in results[run_id].get("agent_data", []):
+                    writer.writerow([run_id] + [node_data.get(col, "") 
+                                                for col in columns])
+    return results
@@ -1,5 +1,7 @@
 import numpy as np
 
+from analysis_functions import Run
+
 """
 Source data format
 {timestamp:
@@ -17,6 +19,16 @@ Source data format
 timestamp 2: {...}
 ...
 }
+
+The _array functions are vectorized counterparts of the functions above,
+which work on the same data as sparse (COO) triplets instead: aligned arrays
+    time: index of the timestamp in the sorted list of timestamps
+    source: source agent id
+    target: target agent id
+    value: WTH
+with one entry per (timestamp, source, target) WTH value. Runs exported with
+the "arrays" output format already have them (wth_time, wth_source,
+wth_target and wth_value); get_wth_triplets() gets them from any run.
 """
 
 def get_agent_wth_by_ts(data):
@@ -53,6 +65,122 @@ def get_agent_wth_avg_all_runs(agent_wth_avgs):
 
 
 
+def wth_triplets_from_data(data):
+    '''
+    Convert the willingness_to_help of data in the source data format to
+    sparse triplets.
+    
+    Returns:
+        (timestamps, time, source, target, value), where timestamps is the
+        sorted list of timestamps that time indexes into.
+    '''
+    timestamps = sorted(data)
+    time, source, target, value = [], [], [], []
+    for i, ts in enumerate(timestamps):
+        for agent, entries in data[ts]['willingness_to_help'].iteritems():
+            for neighbor, wth in entries.iteritems():
+                time.append(i)
+                source.append(agent)
+                target.append(neighbor)
+                value.append(wth)
+    return (timestamps, np.array(time, dtype=np.int64), 
+            np.array(source, dtype=np.int64), np.array(target, dtype=np.int64),
+            np.array(value, dtype=np.float64))
+
+def get_wth_triplets(run):
+    '''
+    Get a run's willingness_to_help as sparse triplets, from its arrays if 
+    it has them, or else from its data.json or data.ndjson.
+    
+    Args:
+        run: A Run, or the path to a run's output directory.
+    
+    Returns:
+        (timestamps, time, source, target, value), as from 
+        wth_triplets_from_data().
+    '''
+    if not isinstance(run, Run):
+        run = Run(run)
+    if run.has("arrays"):
+        return (run.array("timestamps").tolist(), 
+                np.asarray(run.array("wth_time")),
+                np.asarray(run.array("wth_source")),
+                np.asarray(run.array("wth_target")),
+                np.asarray(run.array("wth_value")))
+    return wth_triplets_from_data(run.load(['willingness_to_help']))
+
+def get_agent_wth_by_ts_array(time, source, value, n_timestamps=None, 
+                              agent_count=None):
+    '''
+    Vectorized get_agent_wth_by_ts.
+    
+    Args:
+        time, source, value: WTH triplet arrays.
+        n_timestamps, agent_count: Shape of the result; by default, just
+            large enough for the largest time index and agent id.
+    
+    Returns an array of...
+        avg_by_agent[timestep, agent] == average of the agent's wth at the
+            timestep, or NaN if it has none
+    '''
+    if n_timestamps is None:
+        n_timestamps = int(time.max()) + 1 if len(time) else 0
+    if agent_count is None:
+        agent_count = int(source.max()) + 1 if len(source) else 0
+    size = n_timestamps * agent_count
+    cells = time * agent_count + source
+    sums = np.bincount(cells, weights=value, minlength=size)
+    counts = np.bincount(cells, minlength=size)
+    avg_by_agent = np.empty(size)
+    avg_by_agent.fill(np.nan)
+    present = counts > 0
+    avg_by_agent[present] = sums[present] / counts[present]
+    return avg_by_agent.reshape(n_timestamps, agent_count)
+
+def get_agent_wth_avg_all_runs_array(avg_by_agent, skip_missing=False):
+    '''
+    Vectorized get_agent_wth_avg_all_runs, over the output of 
+    get_agent_wth_by_ts_array.
+    
+    Args:
+        avg_by_agent: (timesteps, agents) array of average wth.
+        skip_missing: As with np.mean in get_agent_wth_avg_all_runs, an 
+            agent with no wth at any timestep has a NaN average; if True,
+            average over only the timesteps where it has wth instead.
+    
+    Returns an array of...
+        wth_by_agent_all_runs[agent] == average of wth over all timesteps
+    '''
+    if not skip_missing:
+        return avg_by_agent.mean(axis=0)
+    present = ~np.isnan(avg_by_agent)
+    sums = np.where(present, avg_by_agent, 0).sum(axis=0)
+    counts = present.sum(axis=0)
+    wth_by_agent_all_runs = np.empty(avg_by_agent.shape[1])
+    wth_by_agent_all_runs.fill(np.nan)
+    has_wth = counts > 0
+    wth_by_agent_all_runs[has_wth] = sums[has_wth] / counts[has_wth]
+    return wth_by_agent_all_runs
+
+def get_run_wth_by_ts_array(time, value, n_timestamps=None):
+    '''
+    Calculates the average of all the wth values in a run, by timestep.
+    
+    Returns an array of...
+        avg_by_ts[timestep] == average of all wth at the timestep, or NaN
+            if there are none
+    '''
+    if n_timestamps is None:
+        n_timestamps = int(time.max()) + 1 if len(time) else 0
+    sums = np.bincount(time, weights=value, minlength=n_timestamps)
+    counts = np.bincount(time, minlength=n_timestamps)
+    avg_by_ts = np.empty(n_timestamps)
+    avg_by_ts.fill(np.nan)
+    present = counts > 0
+    avg_by_ts[present] = sums[present] / counts[present]
+    return avg_by_ts
+
+
 def main():
     pass 
 
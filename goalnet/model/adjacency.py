@@ -0,0 +1,108 @@
+'''
+GoalNet Adjacency
+=================
+
+The agents' social network, stored compactly.
+
+@author: dmasad
+'''
+
+import networkx as nx
+
+class Adjacency(object):
+    '''
+    An undirected graph over integer node ids, supporting only what the
+    simulation needs: adding nodes and edges, checking whether an edge
+    exists, and iterating over a node's neighbors.
+
+    Each node has a list of its neighbors, in the order the edges were added,
+    and every edge also has a single integer key, (u << 32) | v with u < v,
+    in one set for O(1) edge checks. That is far less than networkx's
+    dict-of-dicts, with an attribute dictionary per edge per direction; use
+    to_networkx() to get a full networkx Graph for analysis or output.
+
+    Attributes:
+        adj: Dictionary mapping each node to the list of its neighbors.
+        edge_keys: Set of the integer keys of all edges.
+    '''
+
+    def __init__(self, nodes=()):
+        self.adj = {}
+        self.edge_keys = set()
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _key(u, v):
+        if u > v:
+            u, v = v, u
+        return (u << 32) | v
+
+    def add_node(self, node):
+        '''
+        Add a node, if it isn't in the graph already.
+        '''
+        if node not in self.adj:
+            self.adj[node] = []
+
+    def add_edge(self, u, v):
+        '''
+        Add an edge between two nodes, adding the nodes if needed.
+
+        Returns:
+            True if the edge was added, False if it already existed.
+        '''
+        key = self._key(u, v)
+        if key in self.edge_keys:
+            return False
+        self.edge_keys.add(key)
+        self.add_node(u)
+        self.add_node(v)
+        self.adj[u].append(v)
+        self.adj[v].append(u)
+        return True
+
+    def has_edge(self, u, v):
+        return self._key(u, v) in self.edge_keys
+
+    def neighbors(self, node):
+        '''
+        The list of a node's neighbors, in the order they were connected.
+
+        This is the stored list itself; don't modify it.
+        '''
+        return self.adj[node]
+
+    def degree(self, node):
+        return len(self.adj[node])
+
+    def nodes(self):
+        return list(self.adj)
+
+    def edges(self):
+        '''
+        Iterate over the edges as (u, v) tuples, with u < v.
+        '''
+        for key in self.edge_keys:
+            yield key >> 32, key & 0xFFFFFFFF
+
+    def number_of_nodes(self):
+        return len(self.adj)
+
+    def number_of_edges(self):
+        return len(self.edge_keys)
+
+    def to_networkx(self):
+        '''
+        Export the graph as a networkx Graph.
+        '''
+        G = nx.Graph()
+        G.add_nodes_from(self.adj)
+        G.add_edges_from(self.edges())
+        return G
+
+    def __contains__(self, node):
+        return node in self.adj
+
+    def __len__(self):
+        return len(self.adj)
@@ -7,10 +7,54 @@ GoalNet Agent Class
 import random
 from collections import namedtuple
 from task import Task
+from willingness import WillingnessToHelp
+from history import HistoryLog
 
 Message = namedtuple('Message', ['sender', 'receiver', 'timestamp', 'type', 'data'])
 
-class Agent(object):
+# How many random neighbors to try when picking an introduction, before
+# listing out all the eligible ones.
+INTRODUCTION_TRIES = 4
+
+class Inbox(object):
+    '''
+    The messages an agent has received, in order of arrival.
+    
+    A message with the same sender, type and data as one already in the inbox
+    is ignored; the (sender, type, data) keys of the messages are kept in a 
+    set, so this check is O(1).
+    '''
+    
+    __slots__ = ('messages', 'keys')
+    
+    def __init__(self):
+        self.messages = []
+        self.keys = set()
+    
+    def add(self, message):
+        '''
+        Add a message to the inbox, unless it is a duplicate.
+        '''
+        key = (message.sender, message.type, message.data)
+        if key not in self.keys:
+            self.keys.add(key)
+            self.messages.append(message)
+    
+    def clear(self):
+        '''
+        Empty the inbox.
+        '''
+        if self.messages:
+            self.messages = []
+            self.keys = set()
+    
+    def __iter__(self):
+        return iter(self.messages)
+    
+    def __len__(self):
+        return len(self.messages)
+
+class BaseAgent(object):
     
     '''
     The basic agent class.
@@ -27,14 +71,17 @@ class Agent(object):
         greed: The proportion of task payoff an agent is inclined to keep
         beta: The discount factor on past events; currently fixed at 1.
         
-        inbox: A list that holds the agents' messages received.Gets cleared by 
+        inbox: An Inbox that holds the agents' messages received.Gets cleared by 
                the agent every turn as the contained messages are processed
         task: Current task object; defaults to None
         possible_tasks: Tasks other agents requested help on
         turns: How many times the agent has been activated
         history: Keep track of history, who worked with and what payoff 
-            received, potentially how the ego felt about the payoff
-        network: List of agents with whom this agent can communicate
+            received, potentially how the ego felt about the payoff; a 
+            HistoryLog of (neighbor, value, timestamp) events
+        wth_engine: The WillingnessToHelp engine that evaluates the history
+        network: List of agents with whom this agent can communicate; a 
+            read-only view of the agent's neighbors in the world's network
         wealth: The total cumulative payoff received, less payoff distributed
         
         Willingness To Help (WTH) model:
@@ -47,8 +94,13 @@ class Agent(object):
                 B provides payoff:
                     (ActualPay - FairPay)/FairPay 
         
+    Subclasses decide where turns and wealth are stored; see Agent.
     '''
     
+    __slots__ = ('name', 'world', 'propensity_to_help', 'centralization',
+                 'greed', 'inbox', 'task', 'task_contributors',
+                 'possible_tasks', 'history', 'outstanding_payoffs',
+                 'beta', 'wth_engine', 'task_team', 'wth')
    
     def __init__(self, name, world, propensity_to_help, centralization, greed):
         '''
@@ -60,22 +112,29 @@ class Agent(object):
         self.centralization = centralization
         self.greed = greed
         
-        self.inbox = [] #where msgs are received from others
+        self.inbox = Inbox() #where msgs are received from others
         self.task = None
         self.task_contributors = [] # Agents who have performed subtasks
         self.possible_tasks = []
         self.turns = 0  #keep track of how many turns an agent has had
         
-        self.history = []
+        self.history = HistoryLog(world.history_capacity)
         self.outstanding_payoffs = {}
         self.beta = 2 # Past discount factor
+        self.wth_engine = WillingnessToHelp(self.history, self.beta,
+                                            world.wth_horizon,
+                                            world.history_min_weight)
         
         self.task_team = []
-        self.network = []
+        world.network.add_node(name)
         self.wth = {} # Most recent willingness-to-help for each neighbor
         
         self.wealth = 0 #This could be the cumulative payoffs
         
+    
+    @property
+    def network(self):
+        return self.world.network.adj[self.name]
             
     def activate(self):
         '''
@@ -112,14 +171,19 @@ class Agent(object):
                 self.world.agents[eachNeighbor].get_message(message)
                   
         elif action == 'ACT':
-            task = self.world.tasks[target]
-            task.execute_subtask(self.world.clock)
+            task = self.world.get_task(target)
+            # Archived tasks are read-only, and already complete.
+            live = target in self.world.tasks
+            if live:
+                task.execute_subtask(self.world.clock)
             # If working on someone else's task, send them a message.
             if self.task is None or target != self.task.task_id:
                 message = Message(self.name, task.owner, self.world.clock,
                                   'Acknowledgment', task.task_id)
                 self.world.agents[task.owner].get_message(message)
-                self.world.tasks[task.task_id].workers.append(self.name)
+                self.world.record_work(task, self.name)
+            if live:
+                self.world.task_changed(task)
                 
         elif action == 'SEEK':
             #look for an introduction from another agent in network
@@ -131,10 +195,8 @@ class Agent(object):
         # Check to see if task complete; if so, distribute payoffs
         if self.task is not None and self.task.is_complete():
             #print "Task %s completed by %s!"% (self.task.task_id, self.name)
-            self.task.completed = True
-            self.task.workers.append(self.name)
-            # Distribute payoffs:
-            self.task.active = False
+            self.world.record_work(self.task, self.name)
+            self.world.complete_task(self.task)
             total_payoff = self.task.payoff
             self.wealth += self.greed * total_payoff
             # Distribute payoffs:
@@ -158,8 +220,9 @@ class Agent(object):
                                   (self.task.task_id, payoff))
                 self.world.agents[agent].get_message(message)
             self.task = None
+            self.world.idle_agents.add(self.name)
                
-        self.inbox = [] 
+        self.inbox.clear()
                 
             
                 
@@ -174,22 +237,16 @@ class Agent(object):
         Returns the computed WTH number, and logs it in self.wth[neighbor]
         '''    
         
-        neighbor_interactions = 0
-        other_interactions = 0
         current_clock = self.world.clock
-        
-        for event in self.history:
-            delta_i = (event[1] / (current_clock - event[2])**self.beta)
-            if event[0] == neighbor:
-                neighbor_interactions += delta_i
-            else:
-                other_interactions += delta_i
+        neighbor_interactions, other_interactions = \
+            self.wth_engine.interactions(neighbor, current_clock)
         #TODO: Why this division?
         other_interactions /= (1.0 * len(self.network))
         #TODO: other_interactions overwhelm neighbor_interactions
         wth = (neighbor_interactions + other_interactions)/2.0
         wth += (self.propensity_to_help / (current_clock)**self.beta)
         self.wth[neighbor] = wth
+        self.world.wth_changed(self.name)
         return wth
             
     
@@ -199,30 +256,34 @@ class Agent(object):
         '''
         #TODO: Fill in.
         
-        # Build task probabilities
-        possible_tasks = {}
+        # Build task probabilities as a list of (task_id, weight) pairs;
+        # ordered, so that the same random number always picks the same task.
+        # (Each task_id appears at most once: the inbox drops duplicate help
+        # requests, and only a task's owner asks for help with it.)
+        possible_tasks = []
         for task_id in self.possible_tasks:
-            task = self.world.tasks[task_id]
+            task = self.world.get_task(task_id)
             owner = task.owner
             wth = self._willingness_to_help(owner)
             fair_pay = (task.payoff * (1.0-self.greed))/task.subtasks
-            possible_tasks[task_id] = wth * fair_pay
+            possible_tasks.append((task_id, wth * fair_pay))
         
         if self.task is not None:
-            possible_tasks[self.task.task_id] = self.task.payoff * self.greed
+            possible_tasks.append((self.task.task_id,
+                                   self.task.payoff * self.greed))
         elif len(self.possible_tasks) > 0:
             mean_weight = 0
-            for w in possible_tasks.values():
+            for task_id, w in possible_tasks:
                 mean_weight += 1
             mean_weight /= (len(possible_tasks)*1.0)
-            possible_tasks[None] = mean_weight
+            possible_tasks.append((None, mean_weight))
             
         # Pick a task based on payoff:
-        total = sum(possible_tasks.values())
+        total = sum(wgt for key, wgt in possible_tasks)
         choice = self.world.random_number_generator.random() * total
         counter = 0
         result = None
-        for key, wgt in possible_tasks.items():
+        for key, wgt in possible_tasks:
             if choice < counter + wgt: 
                 result = key
             else: 
@@ -244,6 +305,12 @@ class Agent(object):
         
         
         
+    def add_history(self, neighbor, value, timestamp):
+        '''
+        Record an interaction with a neighbor in the agent's history.
+        '''
+        self.wth_engine.record(neighbor, value, timestamp)
+    
     '''
     MESSAGE HANDLING
     ================
@@ -256,12 +323,8 @@ class Agent(object):
         Args:
             message: A message object to be added to the inbox
         '''
-        for eachMessage in self.inbox:
-            #ignore non-unique messages
-            if eachMessage.sender == message.sender and eachMessage.type == message.type and eachMessage.data == message.data:
-                break
-        else:#else append the message to the inbox
-            self.inbox.append(message)
+        #ignore non-unique messages
+        self.inbox.add(message)
     
     def evaluate_message(self, message):
         '''
@@ -291,30 +354,55 @@ class Agent(object):
         source = self.world.agents[message.sender]
 
         if self.world.random_number_generator.random() > self.centralization: 
-            possible_connections = [neighbor for neighbor in self.network
-                                        if neighbor != source.name and 
-                                        neighbor not in source.network]
-            if possible_connections == []: return None
-                
-            new_connection = self.world.random_number_generator.choice(possible_connections)
+            new_connection = self._pick_introduction(source.name)
+            if new_connection is None: return None
 
             #Update the networks of both the agents
-            self.world.agents[new_connection].network.append(source.name)
-            self.world.agents[source.name].network.append(new_connection)
-
-            self.world.network.add_edge(source.name, new_connection)
+            self.world.connect(source.name, new_connection)
             # Manually add the event for now
-            source.history.append((self.name, 0.5, self.world.clock))
+            source.add_history(self.name, 0.5, self.world.clock)
         else:
-            source.history.append((self.name, -1.0, self.world.clock))
+            source.add_history(self.name, -1.0, self.world.clock)
             
                 
+    def _pick_introduction(self, source):
+        '''
+        Pick one of this agent's neighbors, uniformly at random from those
+        other than the source and not already connected to it.
+        
+        A few random neighbors are tried first, which finds an eligible one
+        right away unless the source already knows most of this agent's 
+        neighbors; only then are the eligible neighbors listed out. Either
+        way, each eligible neighbor is equally likely to be picked.
+        
+        Returns:
+            The neighbor's name, or None if there are no eligible neighbors.
+        '''
+        network = self.world.network
+        neighbors = self.network
+        if len(neighbors) == 0:
+            return None
+        # A source already connected to everyone has nobody left to meet.
+        if network.degree(source) == len(self.world.agent_ids) - 1:
+            return None
+        
+        for i in range(INTRODUCTION_TRIES):
+            neighbor = self.world.random_number_generator.choice(neighbors)
+            if neighbor != source and not network.has_edge(source, neighbor):
+                return neighbor
+        
+        possible_connections = [neighbor for neighbor in neighbors
+                                if neighbor != source and
+                                not network.has_edge(source, neighbor)]
+        if possible_connections == []:
+            return None
+        return self.world.random_number_generator.choice(possible_connections)
+    
     def process_acknowledgment(self, message):
         '''
         Add a history event when another agent works on your task
         '''
-        new_event = (message.sender, 1.0, message.timestamp)
-        self.history.append(new_event)
+        self.add_history(message.sender, 1.0, message.timestamp)
         self.task_contributors.append(message.sender)
     
             
@@ -326,14 +414,22 @@ class Agent(object):
         '''
         task_id, payoff = message.data # Unpack the tuple
         self.wealth += payoff
-        task = self.world.tasks[task_id]
+        task = self.world.get_task(task_id)
         fair_pay = (task.payoff * (1.0-self.greed))/task.subtasks
         event = 1 + (payoff - fair_pay)/(fair_pay)
-        self.history.append((message.sender, event, message.timestamp))
+        self.add_history(message.sender, event, message.timestamp)
          
         
         
         
         
 
-    
\ No newline at end of file
+    
+
+
+class Agent(BaseAgent):
+    '''
+    The standard agent, with turns and wealth stored on the agent itself.
+    '''
+    
+    __slots__ = ('turns', 'wealth')
@@ -0,0 +1,125 @@
+'''
+GoalNet Agent State Store
+=========================
+
+An optional structure-of-arrays store for the agents' changing numeric
+attributes.
+
+@author: dmasad
+'''
+
+import numpy as np
+
+from agent import BaseAgent
+
+# The numeric agent attributes kept as columns, and their dtypes. These are
+# the ones that change as the model runs; propensity_to_help, centralization
+# and greed are read far more often than they change, so they stay plain
+# attributes of the agent, with no column that could fall out of step.
+COLUMNS = [("wealth", np.float64),
+           ("turns", np.int64)]
+
+class AgentState(object):
+    '''
+    Holds one NumPy array per numeric agent attribute, with one row per agent.
+    
+    Data collection and analysis can read a whole column at once, rather than
+    walking every Agent object.
+    
+    Attributes:
+        columns: Dictionary mapping each attribute name to its array. The
+            arrays may be longer than the number of agents; only the first
+            size rows are in use.
+        ids: List of the agent id in each row.
+        size: Number of rows in use.
+    '''
+    
+    def __init__(self, capacity=0):
+        '''
+        Create a new, empty store with room for capacity agents.
+        '''
+        self.columns = {}
+        for name, dtype in COLUMNS:
+            self.columns[name] = np.zeros(capacity, dtype=dtype)
+        self.ids = []
+        self.size = 0
+    
+    def add_row(self, agent_id):
+        '''
+        Add a zeroed row for a new agent, growing the arrays if needed.
+        
+        Returns:
+            The index of the new row.
+        '''
+        capacity = len(self.columns["wealth"])
+        if self.size == capacity:
+            new_capacity = max(2 * capacity, 16)
+            for name in self.columns:
+                column = np.zeros(new_capacity, 
+                                  dtype=self.columns[name].dtype)
+                column[:capacity] = self.columns[name]
+                self.columns[name] = column
+        self.ids.append(agent_id)
+        self.size += 1
+        return self.size - 1
+    
+    def column(self, name):
+        '''
+        Get the values of an attribute for all agents, in row order.
+        '''
+        return self.columns[name][:self.size]
+    
+    def as_dict(self, name):
+        '''
+        Get a dictionary mapping each agent id to its value of an attribute.
+        '''
+        return dict(zip(self.ids, self.column(name).tolist()))
+
+
+def _column_property(name):
+    '''
+    Build a property that reads and writes the agent's row in a column, as
+    Python scalars.
+    '''
+    def fget(self):
+        return self.state.columns[name].item(self.row)
+    def fset(self, value):
+        self.state.columns[name].itemset(self.row, value)
+    return property(fget, fset)
+
+
+class ColumnarAgent(BaseAgent):
+    '''
+    An Agent whose turns and wealth live in a row of an AgentState, rather
+    than on the agent.
+    
+    Behaves exactly like Agent otherwise.
+    
+    Attributes:
+        state: The AgentState holding this agent's numeric attributes.
+        row: This agent's row in the state arrays.
+    '''
+    
+    __slots__ = ('state', 'row')
+    
+    def __init__(self, name, world, propensity_to_help, centralization, greed):
+        self.state = world.agent_state
+        self.row = self.state.add_row(name)
+        BaseAgent.__init__(self, name, world, propensity_to_help, 
+                           centralization, greed)
+    
+    def __getstate__(self):
+        '''
+        Pickle the agent's attributes; its turns and wealth are pickled
+        along with the AgentState.
+        '''
+        slots = BaseAgent.__slots__ + self.__slots__
+        return dict((slot, getattr(self, slot)) for slot in slots
+                    if hasattr(self, slot))
+    
+    def __setstate__(self, state):
+        for slot, value in state.iteritems():
+            setattr(self, slot, value)
+
+for _name, _dtype in COLUMNS:
+    setattr(ColumnarAgent, _name, _column_property(_name))
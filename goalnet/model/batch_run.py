@@ -10,15 +10,42 @@ accordingly.
 
 '''
 
-from world import World
+from sweep import run_sweep
 
 
 '''
-Pass 4 - May 09
+Pass 5
 ----------------------------
 
+Same grid as Pass 4, run through the sweep runner: the runs go out to a
+process pool instead of being run one at a time, and re-running this script
+picks up where a crashed or interrupted sweep left off.
+
 * * * 
 '''
+if __name__ == "__main__":
+    agent_count = 100
+    grid = {"initial_configuration": ["Random1"],
+            "agent_count": [agent_count],
+            "task_speed": [1, 2, 4, 8, 16]}
+    base_config = {"max_clock": agent_count * 2,
+                   "collection_intervals": agent_count/50,
+                   "stream_output": True}
+    run_sweep(grid, replicates=3, base_config=base_config, name="pass5")
+    print "Done!"
+
+'''
+End Pass 5
+----------
+'''
+
+
+
+'''
+Pass 4 - May 09
+----------------------------
+
+* * * 
 num_runs = 3 # Number of runs per combination
 agent_count = 100
 task_speeds = [1, 2, 4, 8, 16]
@@ -38,6 +65,9 @@ for run in range(num_runs):
       w.data_collector.export()
 print "Done!"
 
+End Pass 4
+----------
+'''
 '''
 End Pass 3
 ----------
@@ -0,0 +1,102 @@
+'''
+GoalNet Checkpoints
+===================
+
+Save a running World to disk, and restore it to continue exactly where it
+left off.
+
+@author: dmasad
+
+A checkpoint is the whole World (agents, tasks, network, scheduler queue,
+random number streams and data collector) pickled into a gzipped file.
+Restoring it and running on gives bit-for-bit the same run as if it had
+never stopped.
+
+Example:
+    config = {"agent_count": 400, "max_clock": 1600,
+              "checkpoint_interval": 100, "stream_output": True}
+    w = World(config)
+    ...
+    # After a crash:
+    w = load_checkpoint(checkpoint_path(w.data_collector.uuid))
+    while w.tick() is not None:
+        pass
+    w.data_collector.export()
+    remove_checkpoint(w.data_collector.uuid)
+
+A checkpoint is only useful while its run is in progress; remove it once the
+run is exported, rather than leaving a full copy of the world behind in every
+finished run's output directory.
+'''
+
+import cPickle
+import gzip
+import os
+
+from datacollector import OUTPUT_PATH
+
+CHECKPOINT_FILE = "checkpoint.pkl.gz"
+
+
+def checkpoint_path(run_id):
+    '''
+    The default checkpoint file for a run, in its output directory.
+    '''
+    return OUTPUT_PATH + str(run_id) + "/" + CHECKPOINT_FILE
+
+
+def save_checkpoint(world, filepath=None):
+    '''
+    Save the full state of a World.
+
+    The checkpoint is written to a temporary file first and then moved into
+    place, so a crash while saving leaves the previous checkpoint intact.
+
+    Args:
+        world: The World to save.
+        filepath: Where to save it; defaults to checkpoint.pkl.gz in the
+            run's output directory.
+
+    Returns:
+        The path the checkpoint was saved to.
+    '''
+    if filepath is None:
+        world.data_collector.open_output()
+        filepath = world.data_collector.path + CHECKPOINT_FILE
+    temp_path = filepath + ".tmp"
+    f = gzip.open(temp_path, "wb")
+    try:
+        cPickle.dump(world, f, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    os.rename(temp_path, filepath)
+    return filepath
+
+
+def remove_checkpoint(run_id):
+    '''
+    Delete a run's checkpoint from its output directory, if it has one.
+    '''
+    filepath = checkpoint_path(run_id)
+    if os.path.exists(filepath):
+        os.remove(filepath)
+
+
+def load_checkpoint(filepath):
+    '''
+    Restore a World from a checkpoint.
+
+    If the run streams its output, any deltas written to its data.ndjson
+    after the checkpoint was taken are dropped, so that continuing the run
+    writes them again rather than twice.
+
+    Returns:
+        The restored World, ready to tick() on.
+    '''
+    f = gzip.open(filepath, "rb")
+    try:
+        world = cPickle.load(f)
+    finally:
+        f.close()
+    world.data_collector.resume_stream()
+    return world
@@ -11,84 +11,177 @@ import csv
 import uuid
 import os
 
+import numpy as np
 import networkx as nx
 
+from task import TaskRecord
+
+OUTPUT_PATH = "../outputs/"
+
 class DataCollector(object):
     '''
     This class collects data from the world.
-    
+
     Overall structure:
-        data is a dictionary that will contain all the data collected. Each key
-        is a timestamp at which data has been collected.
-    
+        Rather than a full copy of the world's state, each collection only
+        records what has changed since the previous one. deltas is a
+        dictionary with a key for each timestamp at which data has been
+        collected, whose value is a dictionary of:
+            "wealth": {agent_id: wealth} for agents whose wealth changed
+            "tasks": {task_id: TaskRecord} for tasks created or changed
+            "edges": [(agent_1, agent_2), ...] edges added to the network
+            "willingness_to_help": (source, target, value) for WTH entries
+                that changed, as sparse (COO) triplets: aligned NumPy arrays
+                of each entry's agent_id, neighbor and WTH
+            "task_counts": The number of active and completed tasks
+            "task_network": [(worker, owner, weight), ...] task network 
+                edges whose weight changed, with their new weight
+        timestamps lists the collection timestamps in order. The full state at
+        any of them can be rebuilt with snapshot(); the state of the tasks
+        at any time with tasks_at(), and each task's history with 
+        task_history(). Since TaskRecords are immutable, a record is only
+        stored again when its task changes.
+
+        To know what has changed, the World reports new edges, changed
+        tasks and task network edges as they happen, and agents report when
+        they update their WTH; wealth is compared against its value at the
+        last collection.
+
+    Streaming:
+        If the world's "stream_output" option is on, the deltas are not kept
+        in memory. Instead, on the first collection the output directory
+        (OUTPUT_PATH/uuid) is created and config.json written to it, and each
+        delta is then appended to data.ndjson in it as soon as it is 
+        collected, as one json record per line with its "timestamp" added.
+        Memory use then doesn't grow with the length of the run, and a run
+        that dies partway still leaves its data up to that point on disk.
+        replay() and snapshot() read the deltas back from the file.
+
+    Checkpoints:
+        The collector pickles along with its World; the stream itself is
+        left out, and stream_offset records how many bytes of data.ndjson
+        belong to the pickled state. resume_stream() cuts the file back to
+        that length when the World is restored.
+
     '''
 
 
     def __init__(self, world):
         '''
         Create a new Data Collector and link it to the World object.
-        
+
         Args:
             world: The world object to collect data on.
         '''
         self.world = world
-        self.data = defaultdict(dict)
-        self.uuid = uuid.uuid4()
-    
+        self.deltas = {}
+        self.timestamps = []
+        self.last_timestamp = None
+        self.uuid = world.config.get("run_id", None) or uuid.uuid4()
+        self.path = None
+        self.stream = None
+        self.stream_offset = 0
+
+        # Changes since the last collection
+        self.new_edges = []
+        self.changed_tasks = set()
+        self.changed_task_edges = set()
+        self.changed_wth = set()
+        self.last_delta = None
+
+        # State at the last collection, to compare against
+        self.last_wealth = {}
+        self.last_wealth_column = None
+        self.last_wth = defaultdict(dict)
+
+    def __getstate__(self):
+        '''
+        Pickle everything but the open stream, recording how far into it
+        the data had been written instead.
+        '''
+        state = self.__dict__.copy()
+        if self.stream is not None:
+            self.stream.flush()
+            state["stream_offset"] = self.stream.tell()
+        state["stream"] = None
+        return state
+
     '''
     DATA COLLECTION FUNCTIONS
     '''
-    
+
     def collect_wealth(self):
         '''
         Collect the current wealth variable for all agents.
-        '''    
+        '''
+        if self.world.agent_state is not None:
+            return self.world.agent_state.as_dict("wealth")
         wealths = {}
         for agent_id, agent in self.world.agents.items():
             wealths[agent_id] = agent.wealth
         return wealths
-    
+
     def collect_tasks(self):
         '''
-        Collects data on all tasks.
+        Collects data on all tasks; with task archival on, only on the tasks
+        that have not been archived.
         '''
         task_data = {}
         for task_id, task in self.world.tasks.items():
-            task_data[task_id] = task.__dict__
+            task_data[task_id] = task.to_record()
         return task_data
-    
+
+    def collect_task_counts(self):
+        '''
+        Collects the number of active and completed tasks.
+        '''
+        return {"active": len(self.world.active_tasks),
+                "completed": len(self.world.completed_task_ids)}
+
     def collect_network(self):
         '''
         Collects the current state of the network.
         '''
-        return self.world.network.copy()
-    
+        return self.world.network.to_networkx()
+
     def collect_task_network(self, include_data = True):
         '''
         Collects data on the network formed by the task performance relationships.
-        
-        Returns a directed graph, with edges directed to the task owner.
-        
+
+        Returns a directed graph, with edges directed to the task owner and
+        weighted by how much work the worker has done for the owner.
+
         Args:
             include_data: if True, include node attributes.
-        
+
         '''
-        task_network = nx.DiGraph()
-        for task_id, task in self.world.tasks.iteritems():
-            for worker in task.workers:
-                task_network.add_edge(worker, task.owner)
-        
+        edges = self.world.task_network.edges()
         if not include_data:
+            return self._task_network(edges)
+        return self._task_network(edges, self.collect_wealth())
+
+    def _task_network(self, edges, wealth=None):
+        '''
+        Build a task network from weighted edges.
+
+        Args:
+            edges: Iterable of (worker, owner, weight) tuples.
+            wealth: If given, a dictionary of agent wealth; node attributes
+                are added to the network.
+        '''
+        task_network = nx.DiGraph()
+        task_network.add_weighted_edges_from(edges)
+        if wealth is None:
             return task_network
-        
+
         for agent_id in task_network.nodes():
             agent = self.world.agents[agent_id]
-            task_network.node[agent_id]['wealth'] = float(agent.wealth)
+            task_network.node[agent_id]['wealth'] = float(wealth[agent_id])
             task_network.node[agent_id]['greed'] = float(agent.greed)
             task_network.node[agent_id]['centralization'] = float(agent.centralization)
         return task_network
-            
-    
+
+
     def willingness_to_help(self):
         '''
         Collects the data on each agent's Willingness to Help others
@@ -100,93 +193,599 @@ class DataCollector(object):
             for key, val in agent.wth.items():
                 current_wth[key] = val
             willingness_to_help[agent_id] = current_wth
-        
+
         return willingness_to_help
-    
+
+    '''
+    CHANGE COLLECTION FUNCTIONS
+    '''
+
+    def collect_wealth_changes(self):
+        '''
+        Collect the wealth of the agents whose wealth has changed.
+        
+        With columnar agents, the whole wealth column is compared against
+        its copy from the last collection at once.
+        '''
+        state = self.world.agent_state
+        if state is not None:
+            wealth = state.column("wealth")
+            last = self.last_wealth_column
+            if last is None or len(last) != len(wealth):
+                rows = np.arange(len(wealth))
+            else:
+                rows = np.flatnonzero(wealth != last)
+            self.last_wealth_column = wealth.copy()
+            return dict(zip([state.ids[row] for row in rows.tolist()],
+                            wealth[rows].tolist()))
+        wealth = self.collect_wealth()
+        last_wealth = self.last_wealth
+        changed = {}
+        for agent_id, value in wealth.iteritems():
+            if last_wealth.get(agent_id) != value:
+                changed[agent_id] = value
+        self.last_wealth = wealth
+        return changed
+
+    def collect_task_changes(self):
+        '''
+        Collect data on the tasks created or changed.
+        '''
+        changed = {}
+        for task_id in self.changed_tasks:
+            changed[task_id] = self.world.get_task(task_id).to_record()
+        self.changed_tasks = set()
+        return changed
+
+    def collect_new_edges(self):
+        '''
+        Collect the edges added to the network.
+        '''
+        new_edges = self.new_edges
+        self.new_edges = []
+        return new_edges
+
+    def collect_task_network_changes(self):
+        '''
+        Collect the task network edges whose weight has changed.
+        '''
+        weights = self.world.task_network.weights
+        changed = [(worker, owner, weights[(worker, owner)])
+                   for worker, owner in sorted(self.changed_task_edges)]
+        self.changed_task_edges = set()
+        return changed
+
+    def collect_wth_changes(self):
+        '''
+        Collect the Willingness to Help entries that have changed.
+
+        Entries are in (source, target) order, not dictionary order, so a
+        run restored from a checkpoint collects them in the same order as
+        one that never stopped.
+
+        Returns:
+            A (source, target, value) tuple of arrays; see wth_triplets().
+        '''
+        sources, targets, values = [], [], []
+        for agent_id in sorted(self.changed_wth):
+            last_wth = self.last_wth[agent_id]
+            wth = self.world.agents[agent_id].wth
+            for key in sorted(wth):
+                val = wth[key]
+                if last_wth.get(key) != val:
+                    sources.append(agent_id)
+                    targets.append(key)
+                    values.append(val)
+                    last_wth[key] = val
+        self.changed_wth = set()
+        return wth_triplets(sources, targets, values)
+
     def collect_all_data(self):
         '''
-        Run all data collection functions and update the data dictionary.
+        Run all data collection functions and record the changes since the
+        last collection.
         '''
         clock = self.world.clock
-        current_data = {}
-        
-        current_data["wealth"] = self.collect_wealth()
-        current_data["tasks"] = self.collect_tasks()
-        current_data["network"] = self.collect_network()
-        current_data["task_network"] = self.collect_task_network()
-        current_data["willingness_to_help"] = self.willingness_to_help()
+        delta = {}
+
+        delta["wealth"] = self.collect_wealth_changes()
+        delta["tasks"] = self.collect_task_changes()
+        delta["task_counts"] = self.collect_task_counts()
+        delta["edges"] = self.collect_new_edges()
+        delta["willingness_to_help"] = self.collect_wth_changes()
+        delta["task_network"] = self.collect_task_network_changes()
         #TODO: Add more functions here
+
+        self.last_timestamp = clock
+        self.last_delta = delta
+        if self.world.config.get("stream_output", False):
+            self.write_delta(clock, delta)
+        else:
+            self.deltas[clock] = delta
+            self.timestamps.append(clock)
+
+    '''
+    STATE RECONSTRUCTION FUNCTIONS
+    '''
+
+    def iter_deltas(self):
+        '''
+        Iterate over the (timestamp, delta) pairs collected so far, in order,
+        from memory or from the stream file.
+        '''
+        if self.path is None or not self.world.config.get("stream_output"):
+            for timestamp in self.timestamps:
+                yield timestamp, self.deltas[timestamp]
+            return
         
-        self.data[clock] = current_data
-    
-    
+        if self.stream is not None:
+            self.stream.flush()
+        with open(self.path + "data.ndjson", "rb") as f:
+            for line in f:
+                yield decode_delta(json.loads(line))
+
+    def replay(self):
+        '''
+        Rebuild the state at each collection timestamp, in order.
+
+        Yields (timestamp, state) tuples, where state is a dictionary with the
+        same keys as a delta, except that "edges" is replaced by "network",
+        the networkx Graph, and "task_network" is the weighted networkx 
+        DiGraph. The same state objects are updated in place from one 
+        timestamp to the next; copy anything that needs to be kept.
+        '''
+        wealth = {}
+        tasks = {}
+        network = nx.Graph()
+        network.add_nodes_from(self.world.agents)
+        task_network = nx.DiGraph()
+        willingness_to_help = dict((agent_id, {})
+                                   for agent_id in self.world.agents)
+        for timestamp, delta in self.iter_deltas():
+            wealth.update(delta["wealth"])
+            tasks.update(delta["tasks"])
+            network.add_edges_from(delta["edges"])
+            task_network.add_weighted_edges_from(delta["task_network"])
+            source, target, value = delta["willingness_to_help"]
+            for agent_id, neighbor, wth in zip(source.tolist(), 
+                                               target.tolist(),
+                                               value.tolist()):
+                willingness_to_help[agent_id][neighbor] = wth
+            yield timestamp, {"wealth": wealth,
+                              "tasks": tasks,
+                              "task_counts": delta["task_counts"],
+                              "network": network,
+                              "task_network": task_network,
+                              "willingness_to_help": willingness_to_help}
+
+    @property
+    def data(self):
+        '''
+        The full state at every collection timestamp, as a dictionary of
+        {timestamp: state}, with the same variables as snapshot() and each
+        task as a dictionary (see TaskRecord.to_dict()).
+
+        This is rebuilt from the deltas on every access, and holds a full
+        copy of the state for every timestamp; for long runs, iterate over
+        replay() instead.
+        '''
+        data = {}
+        for timestamp, state in self.replay():
+            tasks = dict((task_id, record.to_dict())
+                         for task_id, record in state["tasks"].iteritems())
+            willingness_to_help = dict(
+                (agent_id, dict(wth))
+                for agent_id, wth in state["willingness_to_help"].iteritems())
+            data[timestamp] = {"wealth": dict(state["wealth"]),
+                               "tasks": tasks,
+                               "task_counts": dict(state["task_counts"]),
+                               "network": state["network"].copy(),
+                               "task_network": state["task_network"].copy(),
+                               "willingness_to_help": willingness_to_help}
+        return data
+
+    def snapshot(self, timestamp):
+        '''
+        Rebuild the full state at the given collection timestamp.
+
+        Returns:
+            A dictionary with the wealth, tasks, task_counts, network,
+            task_network (with node attributes) and willingness_to_help at
+            that time.
+        '''
+        for current_timestamp, state in self.replay():
+            if current_timestamp == timestamp:
+                edges = [(worker, owner, data["weight"]) for worker, owner, data
+                         in state["task_network"].edges(data=True)]
+                state["task_network"] = self._task_network(edges,
+                                                           state["wealth"])
+                return state
+        raise KeyError(timestamp)
+
+    def tasks_at(self, timestamp):
+        '''
+        Get the state of all tasks at a point in time.
+
+        Args:
+            timestamp: Any clock time; the state is as of the last
+                collection at or before it.
+
+        Returns:
+            A dictionary mapping each task_id to its TaskRecord.
+        '''
+        tasks = {}
+        for current_timestamp, delta in self.iter_deltas():
+            if current_timestamp > timestamp:
+                break
+            tasks.update(delta["tasks"])
+        return tasks
+
+    def task_history(self, task_id):
+        '''
+        Get every state a task has been collected in.
+
+        Returns:
+            A list of (timestamp, TaskRecord) tuples, one for each collection 
+            at which the task was new or had changed.
+        '''
+        history = []
+        for timestamp, delta in self.iter_deltas():
+            if task_id in delta["tasks"]:
+                history.append((timestamp, delta["tasks"][task_id]))
+        return history
+
+
     '''
     DATA OUTPUT FUNCTIONS
     '''
-        
+
+    def open_output(self):
+        '''
+        Create the output directory, if needed, and save the configuration
+        to it.
+        '''
+        if self.path is None:
+            self.path = OUTPUT_PATH + str(self.uuid) + "/"
+            if not os.path.exists(self.path):
+                os.mkdir(self.path)
+        with open(self.path + "config.json", "wb") as f:
+            json.dump(self.world.config, f)
+
+    def write_delta(self, timestamp, delta):
+        '''
+        Append a delta to the data.ndjson stream, opening it if needed.
+
+        Keys are written sorted, so the stream doesn't depend on dictionary
+        order, which can change when a World is restored from a checkpoint.
+        '''
+        if self.stream is None:
+            self.open_output()
+            self.stream = open(self.path + "data.ndjson", "ab")
+        record = dict(delta)
+        record["tasks"] = dict((task_id, task.to_dict())
+                               for task_id, task in delta["tasks"].iteritems())
+        source, target, value = delta["willingness_to_help"]
+        record["willingness_to_help"] = {"source": source.tolist(),
+                                         "target": target.tolist(),
+                                         "value": value.tolist()}
+        record["timestamp"] = timestamp
+        self.stream.write(json.dumps(record, sort_keys=True) + "\n")
+        self.stream.flush()
+
+    def resume_stream(self):
+        '''
+        Truncate the data stream back to its length when this collector was
+        pickled, dropping any deltas written after that.
+        '''
+        if not self.world.config.get("stream_output", False):
+            return
+        filepath = OUTPUT_PATH + str(self.uuid) + "/data.ndjson"
+        if os.path.exists(filepath):
+            with open(filepath, "r+b") as f:
+                f.truncate(self.stream_offset)
+
+    def branch(self, uuid):
+        '''
+        Start writing to a new output directory, for a branch of the run.
+
+        If the run streams its output, the new directory's data.ndjson starts
+        with a copy of everything streamed so far.
+        '''
+        if self.stream is not None:
+            self.stream.flush()
+            offset = self.stream.tell()
+        else:
+            offset = self.stream_offset
+        old_path = self.path
+        self.uuid = uuid
+        self.path = None
+        self.stream = None
+        self.stream_offset = 0
+        if not self.world.config.get("stream_output", False):
+            return
+        if old_path is not None and os.path.exists(old_path + "data.ndjson"):
+            self.open_output()
+            with open(old_path + "data.ndjson", "rb") as source:
+                with open(self.path + "data.ndjson", "wb") as target:
+                    remaining = offset
+                    while remaining > 0:
+                        chunk = source.read(min(remaining, 2**20))
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        remaining -= len(chunk)
+
+    def close(self):
+        '''
+        Close the data stream, if there is one.
+        '''
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
     def export(self):
         '''
         Export all data.
         '''
-        path = "../outputs/" + str(self.uuid)
-        os.mkdir(path)
-        path += "/"
-        
         # Save configuration
-        with open(path + "config.json", "wb") as f:
-            json.dump(self.world.config, f)
-        
-        # Write the time series of dicts
-        self.write_json(path + "data.json")
-        
+        self.open_output()
+        path = self.path
+
+        # Write the time series of dicts, and/or the arrays
+        output_format = self.world.config.get("output_format", "json")
+        if output_format in ["json", "both"]:
+            self.write_json(path + "data.json")
+        if output_format in ["arrays", "both"]:
+            self.write_arrays(path + "arrays/")
+
         # Write last task graph
-        last_task_graph = self.data[max(self.data)]["task_network"]
+        last_task_graph = self.snapshot(self.last_timestamp)["task_network"]
         nx.write_graphml(last_task_graph, path+"last_task_graph.graphml")
-        
-    
-    
+        self.close()
+
+
+
     def write_json(self, filepath):
         '''
-        Export all the data collected so far to one big json.
-        '''
-        json_out = {}
-        for key in self.data:
-            current_out = {}
-            for var in ["wealth", "tasks", "willingness_to_help"]:
-                current_out[var] = self.data[key][var]
-            json_out[key] = current_out
+        Export the state at every collection timestamp to one big json.
 
+        The json is written one timestamp at a time, as the state is rebuilt.
+        The byte offsets at which each variable's value starts and ends for
+        each timestamp are written alongside it, to a .index.json file with
+        the same base name:
+            {"timestamps": [t_0, t_1, ...],
+             "offsets": {var: [[start_0, end_0], [start_1, end_1], ...]}}
+        so that a single variable or time slice can be read without parsing
+        the whole file.
+        '''
+        variables = ["wealth", "tasks", "task_counts", "willingness_to_help"]
+        timestamps = []
+        offsets = defaultdict(list)
+        # Most tasks don't change from one timestamp to the next, so the json
+        # of each TaskRecord is kept and reused for as long as it's current.
+        task_json = {}
         with open(filepath, "wb") as f:
-            json.dump(json_out, f)
-    
+            f.write("{")
+            for i, (timestamp, state) in enumerate(self.replay()):
+                if i > 0: f.write(", ")
+                f.write('"%s": {' % json.dumps(timestamp))
+                for j, var in enumerate(variables):
+                    if j > 0: f.write(", ")
+                    f.write('"%s": ' % var)
+                    start = f.tell()
+                    if var == "tasks":
+                        self._dump_tasks(state[var], task_json, f)
+                    else:
+                        json.dump(state[var], f)
+                    offsets[var].append((start, f.tell()))
+                f.write("}")
+                timestamps.append(timestamp)
+            f.write("}")
+
+        index_path = os.path.splitext(filepath)[0] + ".index.json"
+        with open(index_path, "wb") as f:
+            json.dump({"timestamps": timestamps, "offsets": offsets}, f)
+
+    @staticmethod
+    def _dump_tasks(tasks, task_json, f):
+        '''
+        Write a {task_id: TaskRecord} dictionary to a file as json, using
+        and updating a {task_id: (record, json)} cache.
+        '''
+        items = []
+        for task_id, record in tasks.iteritems():
+            cached = task_json.get(task_id)
+            if cached is None or cached[0] is not record:
+                cached = (record, json.dumps(record.to_dict()))
+                task_json[task_id] = cached
+            items.append('"%d": %s' % (task_id, cached[1]))
+        f.write("{" + ", ".join(items) + "}")
+
+    def write_arrays(self, dirpath):
+        '''
+        Export the collected data as a directory of typed NumPy arrays.
+        
+        Each variable is saved to its own .npy file, so that it can be loaded
+        on its own, and memory-mapped rather than read in full. With T 
+        collection timestamps, N agents and K tasks, the arrays are:
+            timestamps: (T,) collection timestamps
+            agent_ids: (N,) agent ids; the column order of wealth
+            wealth: (T, N) wealth of each agent at each timestamp
+            active_tasks, completed_tasks: (T,) task counts
+            task_id, task_owner, task_payoff, task_subtasks, task_timeframe,
+            task_worker_count: (K,) the task table, as of the last timestamp
+            task_created, task_completed: (K,) index of the first timestamp
+                at which each task existed / was completed; -1 if never
+            edge_time, edge_source, edge_target: Network edges, with the
+                index of the first timestamp each one existed at
+            wth_time, wth_source, wth_target, wth_value: The full 
+                Willingness to Help of each source agent for each target
+                at each timestamp index, as sparse triplets
+            task_edge_worker, task_edge_owner, task_edge_weight: The task
+                network edges, with their weights as of the last timestamp
+        See analysis_functions.load_arrays() to read them back.
+        '''
+        if not os.path.exists(dirpath):
+            os.mkdir(dirpath)
+        
+        agent_ids = sorted(self.world.agents)
+        columns = dict((agent_id, i) for i, agent_id in enumerate(agent_ids))
+        
+        timestamps = []
+        wealth = np.zeros(len(agent_ids))
+        wealth_rows = []
+        active_tasks = []
+        completed_tasks = []
+        tasks = {}
+        task_created = {}
+        task_completed = {}
+        edges = []
+        task_edges = {}
+        # The full WTH state, as sorted (source << 32 | target) keys and
+        # their values
+        wth_keys = np.zeros(0, dtype=np.int64)
+        wth_values = np.zeros(0)
+        wth_time, wth_source, wth_target, wth_value = [], [], [], []
+        
+        for t, (timestamp, delta) in enumerate(self.iter_deltas()):
+            timestamps.append(timestamp)
+            
+            for agent_id, value in delta["wealth"].iteritems():
+                wealth[columns[agent_id]] = value
+            wealth_rows.append(wealth.copy())
+            
+            active_tasks.append(delta["task_counts"]["active"])
+            completed_tasks.append(delta["task_counts"]["completed"])
+            for task_id, task in delta["tasks"].iteritems():
+                tasks[task_id] = task
+                if task_id not in task_created:
+                    task_created[task_id] = t
+                if task.completed and task_id not in task_completed:
+                    task_completed[task_id] = t
+            
+            for source, target in delta["edges"]:
+                edges.append((t, source, target))
+            
+            for worker, owner, weight in delta["task_network"]:
+                task_edges[(worker, owner)] = weight
+            
+            source, target, value = delta["willingness_to_help"]
+            if len(value) > 0:
+                keys = (source.astype(np.int64) << 32) | target
+                new_keys = np.union1d(wth_keys, keys)
+                if len(new_keys) > len(wth_keys):
+                    new_values = np.zeros(len(new_keys))
+                    new_values[np.searchsorted(new_keys, wth_keys)] = wth_values
+                    wth_keys, wth_values = new_keys, new_values
+                wth_values[np.searchsorted(wth_keys, keys)] = value
+            if len(wth_keys) > 0:
+                wth_time.append(np.repeat(t, len(wth_keys)))
+                wth_source.append(wth_keys >> 32)
+                wth_target.append(wth_keys & 0xFFFFFFFF)
+                wth_value.append(wth_values.copy())
+        
+        arrays = {}
+        arrays["timestamps"] = np.array(timestamps, dtype=np.float64)
+        arrays["agent_ids"] = np.array(agent_ids, dtype=np.int64)
+        if wealth_rows:
+            arrays["wealth"] = np.vstack(wealth_rows)
+        else:
+            arrays["wealth"] = np.zeros((0, len(agent_ids)))
+        arrays["active_tasks"] = np.array(active_tasks, dtype=np.int64)
+        arrays["completed_tasks"] = np.array(completed_tasks, dtype=np.int64)
+        
+        task_ids = sorted(tasks)
+        arrays["task_id"] = np.array(task_ids, dtype=np.int64)
+        for var, dtype in [("owner", np.int64), ("payoff", np.float64),
+                           ("subtasks", np.int64), ("timeframe", np.float64)]:
+            arrays["task_" + var] = np.array([getattr(tasks[task_id], var)
+                                              for task_id in task_ids],
+                                             dtype=dtype)
+        arrays["task_worker_count"] = np.array(
+            [len(tasks[task_id].workers) for task_id in task_ids], 
+            dtype=np.int64)
+        arrays["task_created"] = np.array(
+            [task_created[task_id] for task_id in task_ids], dtype=np.int64)
+        arrays["task_completed"] = np.array(
+            [task_completed.get(task_id, -1) for task_id in task_ids],
+            dtype=np.int64)
+        
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+        arrays["edge_time"] = edges[:, 0]
+        arrays["edge_source"] = edges[:, 1]
+        arrays["edge_target"] = edges[:, 2]
+        
+        task_edges = np.array([key + (weight,) for key, weight 
+                               in sorted(task_edges.iteritems())],
+                              dtype=np.int64).reshape(-1, 3)
+        arrays["task_edge_worker"] = task_edges[:, 0]
+        arrays["task_edge_owner"] = task_edges[:, 1]
+        arrays["task_edge_weight"] = task_edges[:, 2]
+        
+        for name, parts, dtype in [("wth_time", wth_time, np.int64),
+                                   ("wth_source", wth_source, np.int64),
+                                   ("wth_target", wth_target, np.int64),
+                                   ("wth_value", wth_value, np.float64)]:
+            if parts:
+                arrays[name] = np.concatenate(parts).astype(dtype)
+            else:
+                arrays[name] = np.zeros(0, dtype=dtype)
+        
+        for name, array in arrays.iteritems():
+            np.save(dirpath + name + ".npy", array)
+
     def write_dict_csv(self, filepath, key):
         '''
         Write a csv containing a time series of a dictionary.
-        
+
         Each row will be a timestamp, and each column will be a dictionary
-        key. 
+        key.
         For example: if key == "wealth", each column will be an agent, and each
         row will be the agent's wealth at that timestamp.
-         
+
         '''
         # Assemble the keys
         columns = []
-        for entry in self.data:
-            for col in self.data[entry][key]:
+        for timestamp, state in self.replay():
+            for col in state[key]:
                 if col not in columns:
                     columns.append(col)
-                    
+
         f = open(filepath, "wb")
         writer = csv.writer(f)
         writer.writerow(["timestamp"] + columns)
-        for timestamp, data in self.data.items():
+        for timestamp, state in self.replay():
             row = [timestamp]
             for col in columns:
-                if col in data[key]: row.append(data[key][col])
+                if col in state[key]: row.append(state[key][col])
                 else: row.append(None)
             writer.writerow(row)
-        
-         
-            
-         
-        
\ No newline at end of file
+
+
+def decode_delta(record):
+    '''
+    Convert a delta record read back from json to a (timestamp, delta) pair,
+    restoring the numeric agent and task ids json turned into strings, the
+    TaskRecords it turned into dictionaries, and the WTH arrays it turned
+    into lists.
+    '''
+    timestamp = record.pop("timestamp")
+    record["wealth"] = dict((int(key), val)
+                            for key, val in record["wealth"].iteritems())
+    record["tasks"] = dict((int(key), TaskRecord.from_dict(val))
+                           for key, val in record["tasks"].iteritems())
+    record["edges"] = [tuple(edge) for edge in record["edges"]]
+    record["task_network"] = [tuple(edge) for edge in record["task_network"]]
+    wth = record["willingness_to_help"]
+    record["willingness_to_help"] = wth_triplets(wth["source"], wth["target"],
+                                                 wth["value"])
+    return timestamp, record
+
+
+def wth_triplets(source, target, value):
+    '''
+    Build the (source, target, value) arrays of sparse WTH entries from
+    sequences of agent ids, neighbor ids and WTH values.
+    '''
+    return (np.array(source, dtype=np.int32), np.array(target, dtype=np.int32),
+            np.array(value, dtype=np.float64))
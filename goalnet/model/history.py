@@ -0,0 +1,192 @@
+'''
+GoalNet History Log
+===================
+
+Compact storage for agents' interaction histories.
+
+@author: dmasad
+'''
+
+from __future__ import division
+
+import numpy as np
+
+class HistoryLog(object):
+    '''
+    An array-backed log of (neighbor, value, timestamp) history events.
+
+    Events are kept in three typed NumPy arrays rather than as a list of
+    tuples. Without a capacity the arrays grow as needed; with one, they form
+    a ring buffer and each new event past capacity overwrites the oldest.
+    Events can also be evicted selectively with evict().
+
+    Iterating over the log yields (neighbor, value, timestamp) tuples from
+    oldest to newest, as a list of tuples would.
+
+    Since evicted events are no longer part of any Willingness to Help
+    computation, the log keeps track of how much they could still have
+    contributed: every event evicted with evict() has a timestamp at or
+    before cutoff, and discarded_mass is the sum of their absolute values.
+    See error_bound().
+
+    Events overwritten because the log is at capacity are tracked apart from
+    those, in overwritten, overwritten_mass and overwritten_cutoff. They are
+    dropped however recent they are, so they are left out of error_bound()
+    rather than swamping it; see overwrite_bound().
+
+    Attributes:
+        capacity: Maximum number of events to keep, or None for no limit.
+        neighbors, values, timestamps: The event arrays. Only the first size
+            entries are in use; when the ring buffer has wrapped around, the
+            oldest event is at index start.
+        size: Number of events currently stored.
+        start: Index of the oldest event.
+        discarded_mass: Sum of the absolute values of evicted events.
+        cutoff: Latest timestamp of any evicted event, or None.
+        overwritten: Number of events overwritten at capacity.
+        overwritten_mass: Sum of the absolute values of overwritten events.
+        overwritten_cutoff: Latest timestamp of any overwritten event, or
+            None.
+    '''
+
+    def __init__(self, capacity=None):
+        '''
+        Create a new, empty history log.
+
+        Args:
+            capacity: Optional maximum number of events to keep.
+        '''
+        self.capacity = capacity
+        length = capacity if capacity is not None else 8
+        self.neighbors = np.zeros(length, dtype=np.int32)
+        self.values = np.zeros(length)
+        self.timestamps = np.zeros(length)
+        self.size = 0
+        self.start = 0
+        self.discarded_mass = 0.0
+        self.cutoff = None
+        self.overwritten = 0
+        self.overwritten_mass = 0.0
+        self.overwritten_cutoff = None
+
+    def append(self, neighbor, value, timestamp):
+        '''
+        Add an event to the log, evicting the oldest one if at capacity.
+        '''
+        if self.size == len(self.values):
+            if self.capacity is None:
+                self._grow()
+            else:
+                # Overwrite the oldest event
+                i = self.start
+                self.overwritten += 1
+                self.overwritten_mass += abs(float(self.values[i]))
+                old_timestamp = float(self.timestamps[i])
+                if (self.overwritten_cutoff is None
+                    or old_timestamp > self.overwritten_cutoff):
+                    self.overwritten_cutoff = old_timestamp
+                self.neighbors[i] = neighbor
+                self.values[i] = value
+                self.timestamps[i] = timestamp
+                self.start = (i + 1) % self.capacity
+                return
+        # While the log isn't full, start is always 0.
+        i = self.size
+        self.neighbors[i] = neighbor
+        self.values[i] = value
+        self.timestamps[i] = timestamp
+        self.size += 1
+
+    def _grow(self):
+        '''
+        Double the length of the event arrays.
+        '''
+        length = len(self.values)
+        for name in ["neighbors", "values", "timestamps"]:
+            old = getattr(self, name)
+            new = np.zeros(2 * length, dtype=old.dtype)
+            new[:length] = old
+            setattr(self, name, new)
+
+    def _order(self):
+        '''
+        Array indices of the stored events, from oldest to newest.
+        '''
+        return (np.arange(self.size) + self.start) % len(self.values)
+
+    def _discard(self, values, timestamps):
+        '''
+        Account for events about to be evicted.
+        '''
+        if len(values) == 0:
+            return
+        self.discarded_mass += float(np.abs(values).sum())
+        latest = float(timestamps.max())
+        if self.cutoff is None or latest > self.cutoff:
+            self.cutoff = latest
+
+    def columns(self):
+        '''
+        Get the (neighbors, values, timestamps) arrays of the stored events.
+
+        The arrays are views in storage order, which is only oldest-to-newest
+        if the ring buffer has not wrapped around.
+        '''
+        n = self.size
+        return self.neighbors[:n], self.values[:n], self.timestamps[:n]
+
+    def evict(self, mask):
+        '''
+        Evict events from the log.
+
+        Args:
+            mask: Boolean array, aligned with the arrays from columns(), that
+                is True for each event to evict.
+        '''
+        n = self.size
+        self._discard(self.values[:n][mask], self.timestamps[:n][mask])
+        order = self._order()
+        keep = order[~mask[order]]
+        kept = len(keep)
+        # Fancy indexing copies, so this compacts the kept events in place.
+        self.neighbors[:kept] = self.neighbors[keep]
+        self.values[:kept] = self.values[keep]
+        self.timestamps[:kept] = self.timestamps[keep]
+        self.size = kept
+        self.start = 0
+
+    def error_bound(self, clock, beta):
+        '''
+        Upper bound on how much the events evicted with evict() would
+        contribute to a discounted sum of value/(clock - timestamp)**beta at
+        the given clock.
+
+        Events overwritten at capacity are not included; see
+        overwrite_bound().
+        '''
+        if self.discarded_mass == 0:
+            return 0.0
+        return self.discarded_mass / (clock - self.cutoff)**beta
+
+    def overwrite_bound(self, clock, beta):
+        '''
+        Upper bound on how much the events overwritten at capacity would
+        contribute to a discounted sum at the given clock, as in
+        error_bound().
+
+        Overwrites drop the oldest event whatever its age, so on a small
+        capacity this can stay large; it only says how much the capacity
+        limit may be costing.
+        '''
+        if self.overwritten_mass == 0:
+            return 0.0
+        return self.overwritten_mass / (clock - self.overwritten_cutoff)**beta
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        order = self._order()
+        return iter(zip(self.neighbors[order].tolist(),
+                        self.values[order].tolist(),
+                        self.timestamps[order].tolist()))
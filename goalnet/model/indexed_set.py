@@ -0,0 +1,61 @@
+'''
+GoalNet Indexed Set
+===================
+
+@author: dmasad
+'''
+
+class IndexedSet(object):
+    '''
+    A set that also supports O(1) uniform random selection.
+
+    Items are kept in a list, with a dictionary from each item to its position
+    in the list. Removal swaps the last item into the removed item's slot, so
+    adding, removing, membership and random choice are all O(1).
+
+    Attributes:
+        items: List of the items in the set, in no particular order.
+        positions: Dictionary mapping each item to its index in items.
+    '''
+
+    def __init__(self, items=()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        '''
+        Add an item to the set; does nothing if it is already present.
+        '''
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def discard(self, item):
+        '''
+        Remove an item from the set, if it is present.
+        '''
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self, random_number_generator):
+        '''
+        Pick an item uniformly at random, using the given random.Random
+        object. The set must not be empty.
+        '''
+        return random_number_generator.choice(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
@@ -0,0 +1,88 @@
+'''
+GoalNet Random Streams
+======================
+
+Independent, reproducible random number streams for each part of the model.
+
+@author: dmasad
+'''
+
+import hashlib
+import json
+import random
+
+from variates import RandomVariates
+
+
+def derive_seed(*parts):
+    '''
+    Derive a 32-bit seed from a hash of the given values.
+
+    The same values always give the same seed, in any process and on any
+    platform; different values give unrelated seeds.
+    '''
+    key = json.dumps(parts, sort_keys=True)
+    return int(hashlib.sha1(key).hexdigest()[:8], 16)
+
+
+class RandomStream(object):
+    '''
+    A single named stream of random numbers: a random.Random for choices and
+    uniform draws, and a RandomVariates for everything drawn from NumPy, both
+    seeded from the stream's own seed.
+
+    Attributes:
+        name: The stream's name.
+        seed: The seed both generators were created from.
+        random: A random.Random object.
+        variates: A RandomVariates object.
+    '''
+
+    def __init__(self, name, seed):
+        self.name = name
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.variates = RandomVariates(seed)
+
+    def spawn(self, name):
+        '''
+        Create a child stream, independent of this one and of its other
+        children, whose seed depends only on this stream's seed and the name.
+        '''
+        return RandomStream(self.name + "/" + name, derive_seed(self.seed, name))
+
+
+class RandomStreams(object):
+    '''
+    The set of random number streams for one model run.
+
+    Each stream's seed is derived from the run's root seed and the stream's
+    name, not drawn from a shared generator, so the streams are independent:
+    drawing more or fewer numbers from one (e.g. creating tasks faster) does
+    not change what any other one produces. Two runs with the same root seed
+    therefore share their agent decisions where they can, which is what
+    common-random-numbers comparisons need.
+
+    Attributes:
+        seed: The root seed.
+        streams: Dictionary mapping names to the streams created so far.
+    '''
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.streams = {}
+
+    def get(self, name):
+        '''
+        Get the stream with the given name, creating it if needed.
+        '''
+        if name not in self.streams:
+            self.streams[name] = RandomStream(name, derive_seed(self.seed, name))
+        return self.streams[name]
+
+    def spawn(self, name):
+        '''
+        Create a new, independent set of streams with a root seed derived from
+        this one's and the name.
+        '''
+        return RandomStreams(derive_seed(self.seed, name))
@@ -0,0 +1,127 @@
+'''
+GoalNet Scheduler
+=================
+
+The event queue the World delegates its scheduling to.
+
+@author: dmasad
+'''
+
+from __future__ import division
+
+from collections import namedtuple
+from heapq import heappush, heappop
+
+# Event kinds
+AGENT_ACTIVATION = "agent_activation"
+TASK_CREATION = "task_creation"
+DATA_COLLECTION = "data_collection"
+CHECKPOINT = "checkpoint"
+
+# An event record. The sequence number is unique and increasing, so events
+# with the same timestamp are always popped in the order they were scheduled,
+# and the heap never has to compare anything past the first two fields.
+Event = namedtuple('Event', ['timestamp', 'sequence', 'kind', 'agent_id'])
+
+
+'''
+RESCHEDULING POLICIES
+=====================
+Each policy returns the interval until the next occurrence of an event.
+'''
+
+class FixedInterval(object):
+    '''
+    Reschedule an event a fixed interval after it occurs.
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+
+    def next_interval(self):
+        return self.interval
+
+
+class ExponentialInterval(object):
+    '''
+    Reschedule an event after an exponentially-distributed interval:
+        interval = (-1/speed)*ln(U[0,1])
+    drawn from a RandomVariates service.
+    '''
+    def __init__(self, speed, variates):
+        self.speed = speed
+        self.variates = variates
+
+    def next_interval(self):
+        return self.variates.exponential(self.speed)
+
+
+class Scheduler(object):
+    '''
+    A priority queue of typed events, each with a per-kind handler and
+    rescheduling policy.
+
+    Attributes:
+        queue: A heap of Event records.
+        sequence: The sequence number assigned to the most recent event.
+        kinds: A dictionary mapping each event kind to a (handler, policy)
+            tuple. The handler is called with the Event record; the policy
+            decides when the event recurs, or is None for one-off events.
+    '''
+
+    def __init__(self):
+        '''
+        Create a new, empty scheduler.
+        '''
+        self.queue = []
+        self.sequence = 0
+        self.kinds = {}
+
+    def register(self, kind, handler, policy=None):
+        '''
+        Register (or replace) the handler and rescheduling policy for an
+        event kind.
+        '''
+        self.kinds[kind] = (handler, policy)
+
+    def schedule(self, kind, timestamp, agent_id=None):
+        '''
+        Add an event to the queue at the given timestamp.
+        '''
+        self.sequence += 1
+        heappush(self.queue, Event(timestamp, self.sequence, kind, agent_id))
+
+    def start(self, kind, agent_id=None, delay=0):
+        '''
+        Schedule the first occurrence of an event, one policy interval after
+        the given delay.
+        '''
+        handler, policy = self.kinds[kind]
+        self.schedule(kind, delay + policy.next_interval(), agent_id)
+
+    def pop(self):
+        '''
+        Remove and return the next event from the queue.
+        '''
+        return heappop(self.queue)
+
+    def dispatch(self, event):
+        '''
+        Call the handler for an event, then reschedule it per its policy.
+        '''
+        handler, policy = self.kinds[event.kind]
+        handler(event)
+        if policy is not None:
+            self.schedule(event.kind, event.timestamp + policy.next_interval(),
+                          event.agent_id)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __getstate__(self):
+        '''
+        The handlers are usually bound methods, which can't be pickled; the
+        owner of the scheduler has to register them again after unpickling.
+        '''
+        state = self.__dict__.copy()
+        state["kinds"] = {}
+        return state
@@ -0,0 +1,330 @@
+'''
+GoalNet Parameter Sweeps
+========================
+
+Runs every combination of a grid of model parameters, several times each,
+across a pool of worker processes.
+
+@author: dmasad
+
+Example:
+    grid = {"agent_count": [100, 200],
+            "task_speed": [1, 2, 4, 8, 16],
+            "initial_configuration": ["Random1"]}
+    run_sweep(grid, replicates=3, processes=4,
+              base_config={"stream_output": True})
+
+run_branches() instead runs several variants of one world, each continuing
+from its current (e.g. warmed-up) state:
+    w = World({"agent_count": 100, "max_clock": 400, "random_seed": 1})
+    w.init_schedules()
+    while w.clock < 200:
+        w.tick()
+    run_branches(w, {"base": {}, "fast_tasks": {"task_speed": 4},
+                     "greedy": {}},
+                 modifiers={"greedy": make_greedy})
+
+Each run gets a deterministic run_id (a uuid derived from its configuration)
+that names its outputs/<run_id> directory, and a random_seed derived from its
+parameters and replicate number; so the same sweep always produces the same
+runs. A run is complete once its last_task_graph.graphml has been written;
+re-running a sweep skips complete runs, and continues incomplete ones from
+their last checkpoint if they have one or starts them over if not, so a
+crashed sweep can be resumed by simply running it again.
+'''
+
+from __future__ import division
+
+import csv
+import itertools
+import json
+import os
+import shutil
+import time
+import traceback
+import uuid
+from multiprocessing import Pool
+
+from world import World
+from datacollector import OUTPUT_PATH
+from random_streams import derive_seed
+from checkpoint import checkpoint_path, load_checkpoint, remove_checkpoint
+
+# The world, branches and modifiers being run by run_branches(). They are set
+# before the worker processes are forked, so that each worker inherits a
+# copy-on-write copy rather than having them pickled over to it.
+_branching = None
+
+# Namespace for the run_id uuids.
+SWEEP_NAMESPACE = uuid.UUID("5f1c3a4e-8f0e-4b8e-9c39-2b6f0d6a7e11")
+
+
+def expand_grid(grid, replicates=1, base_config=None, base_seed=0,
+                common_random_numbers=False):
+    '''
+    Build the configuration for each run in a sweep.
+
+    Args:
+        grid: Dictionary mapping config keys to lists of values to sweep.
+        replicates: Number of runs of each combination of values.
+        base_config: Config values shared by all runs.
+        base_seed: Changes every derived seed, for an independent sweep with
+            the same grid.
+        common_random_numbers: If True, the seed depends only on the
+            replicate number, so that every combination of values in the
+            same replicate uses the same random numbers. Otherwise each run
+            gets its own seed.
+
+    If the grid or base_config sets random_seed, replicate 0 uses that seed
+    as given, and each later replicate a seed derived from it and the
+    replicate number, so that replicates are never identical runs; the given
+    seed is kept as "base_random_seed".
+
+    Returns:
+        A list of config dictionaries, each with a "random_seed" and a
+        "run_id" (unless the grid or base_config already sets it).
+    '''
+    if base_config is None:
+        base_config = {}
+    keys = sorted(grid)
+    configs = []
+    for replicate in range(replicates):
+        for values in itertools.product(*[grid[key] for key in keys]):
+            params = dict(zip(keys, values))
+            config = dict(base_config)
+            config.update(params)
+            config["replicate"] = replicate
+            if "random_seed" in config:
+                if replicate > 0:
+                    config["base_random_seed"] = config["random_seed"]
+                    config["random_seed"] = derive_seed(config["random_seed"],
+                                                        replicate)
+            else:
+                if common_random_numbers:
+                    config["random_seed"] = derive_seed(base_seed, replicate)
+                else:
+                    config["random_seed"] = derive_seed(base_seed, replicate,
+                                                        params)
+            if "run_id" not in config:
+                key = json.dumps(config, sort_keys=True)
+                config["run_id"] = str(uuid.uuid5(SWEEP_NAMESPACE, key))
+            configs.append(config)
+    return configs
+
+
+def run_path(run_id):
+    return OUTPUT_PATH + run_id + "/"
+
+
+def is_complete(run_id):
+    '''
+    Check whether a run has finished exporting its output.
+    '''
+    return os.path.exists(run_path(run_id) + "last_task_graph.graphml")
+
+
+def _run_world(run_id, make_world):
+    '''
+    Run a world to the end and export its data, timing it and catching any
+    error, then remove its checkpoint.
+
+    Args:
+        run_id: The run's run_id.
+        make_world: Function that returns the World to run, e.g. a new,
+            restored or branched one.
+
+    Returns:
+        A dictionary with the run_id, the status ("done" or "failed"), the
+        elapsed time, and the error if it failed.
+    '''
+    result = {"run_id": run_id, "status": "done", "elapsed": 0, "error": ""}
+    start = time.time()
+    try:
+        w = make_world()
+        while w.tick() is not None:
+            pass
+        w.data_collector.export()
+        remove_checkpoint(run_id)
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    result["elapsed"] = time.time() - start
+    return result
+
+
+def run_config(config):
+    '''
+    Run the model once with the given config, and export its data.
+
+    If an earlier, interrupted attempt at the same run left a checkpoint
+    (see the "checkpoint_interval" config key), the run continues from it;
+    otherwise any partial output it left is removed, and the run starts over.
+    Once the run is exported, its checkpoint is removed.
+
+    Returns:
+        A result dictionary, as from _run_world().
+    '''
+    run_id = config["run_id"]
+    def make_world():
+        if os.path.exists(checkpoint_path(run_id)):
+            return load_checkpoint(checkpoint_path(run_id))
+        if os.path.exists(run_path(run_id)):
+            shutil.rmtree(run_path(run_id))
+        w = World(dict(config))
+        w.init_schedules()
+        return w
+    return _run_world(run_id, make_world)
+
+
+def write_manifest(path, configs, results):
+    '''
+    Write a csv with one row per run: its run_id, status, elapsed time and
+    error, followed by its configuration.
+    '''
+    config_keys = sorted(set(key for config in configs for key in config))
+    config_keys.remove("run_id")
+    with open(path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(["run_id", "status", "elapsed", "error"] + config_keys)
+        for config in configs:
+            result = results.get(config["run_id"],
+                                 {"status": "pending", "elapsed": "",
+                                  "error": ""})
+            row = [config["run_id"], result["status"], result["elapsed"],
+                   result["error"]]
+            row += [config.get(key, "") for key in config_keys]
+            writer.writerow(row)
+
+
+def _run_pool(name, configs, jobs, worker, manifest_path, processes=None):
+    '''
+    Run a set of runs across a pool of worker processes, skipping the ones
+    already complete, and keeping their manifest up to date.
+
+    Progress is printed as each run finishes, and the manifest is rewritten
+    after each one.
+
+    Args:
+        name: Name of the set of runs, for the progress output.
+        configs: The config of each run, with its run_id.
+        jobs: What to pass the worker for each run, aligned with configs.
+        worker: Function that takes a job, runs it and returns its result
+            (see _run_world()).
+        manifest_path: Where to write the manifest (see write_manifest()).
+        processes: Number of worker processes; defaults to the CPU count.
+
+    Returns:
+        A dictionary mapping each run_id to its result.
+    '''
+    results = {}
+    pending = []
+    for config, job in zip(configs, jobs):
+        if is_complete(config["run_id"]):
+            results[config["run_id"]] = {"status": "done", "elapsed": "",
+                                         "error": ""}
+        else:
+            pending.append(job)
+    print "%s: %d runs, %d already complete" % (name, len(configs),
+                                                 len(configs) - len(pending))
+    write_manifest(manifest_path, configs, results)
+
+    # One run per worker process, so each World's memory is freed with it.
+    pool = Pool(processes, maxtasksperchild=1)
+    start = time.time()
+    try:
+        for i, result in enumerate(pool.imap_unordered(worker, pending)):
+            results[result["run_id"]] = result
+            write_manifest(manifest_path, configs, results)
+            print "[%d/%d] %s %s in %.1fs (%.1fs total)" % (
+                i + 1, len(pending), result["run_id"], result["status"],
+                result["elapsed"], time.time() - start)
+            if result["status"] == "failed":
+                print result["error"]
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+    return results
+
+
+def run_sweep(grid, replicates=1, base_config=None, processes=None,
+              base_seed=0, common_random_numbers=False, name="sweep"):
+    '''
+    Run a parameter sweep in parallel.
+
+    Runs already complete in the output directory are skipped. Progress is
+    printed as each run finishes, and the manifest at
+    OUTPUT_PATH/<name>_manifest.csv is rewritten after each one.
+
+    Args:
+        grid, replicates, base_config, base_seed, common_random_numbers:
+            As in expand_grid().
+        processes: Number of worker processes; defaults to the CPU count.
+        name: Name of the sweep, for its manifest file.
+
+    Returns:
+        A dictionary mapping each run_id to its result (see run_config()).
+    '''
+    configs = expand_grid(grid, replicates, base_config, base_seed,
+                          common_random_numbers)
+    manifest_path = OUTPUT_PATH + name + "_manifest.csv"
+    return _run_pool(name, configs, configs, run_config, manifest_path,
+                     processes)
+
+
+def run_branch(name):
+    '''
+    Run one branch of the world being branched by run_branches(), in this
+    (forked) worker process, and export its data.
+
+    Returns:
+        A result dictionary, as from run_config().
+    '''
+    world, branches, modifiers = _branching
+    return _run_world(world.branch_id(name),
+                      lambda: world.branch(name, branches[name],
+                                           modifiers.get(name), in_place=True))
+
+
+def run_branches(world, branches, modifiers=None, processes=None):
+    '''
+    Run several branches of a world in parallel, each from its current state.
+
+    The world is typically warmed up first; the branches then share the
+    warm-up instead of each simulating it again. Each worker process is
+    forked with a copy-on-write copy of the world, and turns it into its
+    branch in place (see World.branch()). Branches already complete in the
+    output directory are skipped, and a manifest of their status is written
+    to OUTPUT_PATH/<run_id>_branches.csv, for the world's run_id.
+
+    Args:
+        world: The World to branch.
+        branches: Dictionary mapping each branch name to a dictionary of
+            config overrides (see World.branch()), which may be empty.
+        modifiers: Optional dictionary mapping branch names to functions to
+            call on their branch World before it continues.
+        processes: Number of worker processes; defaults to the CPU count.
+
+    Returns:
+        A dictionary mapping each branch's run_id to its result.
+    '''
+    global _branching
+    if modifiers is None:
+        modifiers = {}
+    names = sorted(branches)
+    configs = []
+    for name in names:
+        config = dict(world.config)
+        config.update(branches[name])
+        config["run_id"] = world.branch_id(name)
+        config["branch"] = name
+        configs.append(config)
+    run_id = str(world.data_collector.uuid)
+    manifest_path = OUTPUT_PATH + run_id + "_branches.csv"
+
+    _branching = (world, branches, modifiers)
+    try:
+        return _run_pool(run_id, configs, names, run_branch, manifest_path,
+                         processes)
+    finally:
+        _branching = None
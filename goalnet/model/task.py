@@ -4,6 +4,9 @@ Created on Apr 5, 2013
 @author: dmasad, snayar
 '''
 
+from array import array
+from collections import deque, namedtuple
+
 class Task(object):
     '''
     A task that one or more agents will attempt to perform.
@@ -22,9 +25,20 @@ class Task(object):
         timeframe: The number of clock ticks from the first subtask to the last
             one for the task to succeed.
         owner: The agent that owns the task and is responsible for paying off all the workers
-        subtasks_executed: A list of ticks at which subtasks have been executed.
+        subtasks_executed: A deque of the ticks at which subtasks have been
+            executed, going back no further than timeframe before the latest.
+        executed_count: The total number of subtasks executed.
+    
+    Subtasks are executed in clock order, so a subtask that falls outside the
+    timeframe of the latest one can never count towards completion again; 
+    these are pruned from subtasks_executed as new subtasks come in, and 
+    completion checks only need its length.
         
     '''
+    
+    __slots__ = ('task_id', 'active', 'payoff', 'completed', 'workers',
+                 'subtasks', 'timeframe', 'owner', 'subtasks_executed',
+                 'executed_count')
 
 
     def __init__(self, task_id, payoff, subtasks, timeframe, owner = None):
@@ -39,7 +53,8 @@ class Task(object):
         self.subtasks = subtasks
         self.timeframe = timeframe
         self.owner = owner
-        self.subtasks_executed = []
+        self.subtasks_executed = deque()
+        self.executed_count = 0
         
     
     def execute_subtask(self, tick):
@@ -48,20 +63,23 @@ class Task(object):
         '''
         
         self.subtasks_executed.append(tick)
+        self.executed_count += 1
+        # Drop subtasks that are now outside the timeframe
+        start_time = tick - self.timeframe
+        while self.subtasks_executed[0] < start_time:
+            self.subtasks_executed.popleft()
     
     
     def get_subtasks_remaining(self):
         '''
         Return an estimate of how many subtasks are needed to complete the task.
         '''
-        start_time = max(self.subtasks_executed) - self.timeframe
-        subtasks_allowed = [timestamp for timestamp in self.subtasks_executed
-                            if timestamp >= start_time]
+        subtasks_allowed = len(self.subtasks_executed)
         #if enough subtasks have been completed then 0 (False) remain
-        if len(subtasks_allowed) >= self.subtasks:
+        if subtasks_allowed >= self.subtasks:
             return False
         else: #return the number of subtasks remaining which is the difference between original number of subtasks and the number done so far
-            return self.subtasks - len(subtasks_allowed) 
+            return self.subtasks - subtasks_allowed
         
     def is_complete(self):
         '''
@@ -72,19 +90,184 @@ class Task(object):
             False otherwise
         '''
         
-        #Return False if not enough subtasks executed
-        if len(self.subtasks_executed) < self.subtasks:
-            return False
-        
-        start_time = max(self.subtasks_executed) - self.timeframe 
-        subtasks_allowed = [timestamp for timestamp in self.subtasks_executed
-                            if timestamp >= start_time]
         #If enough subtasks have been executed in a timely manner then return True, else return False
-        if len(subtasks_allowed) >= self.subtasks:
-            return True
-        else:
-            return False
+        return len(self.subtasks_executed) >= self.subtasks
+    
+    def to_record(self):
+        '''
+        Return an immutable TaskRecord of the task's current state, for data 
+        collection.
+        '''
+        return TaskRecord(self.task_id, self.active, self.payoff,
+                          self.completed, tuple(self.workers), self.subtasks,
+                          self.timeframe, self.owner,
+                          tuple(self.subtasks_executed), self.executed_count)
+
 
+class TaskRecord(namedtuple('TaskRecord', ['task_id', 'active', 'payoff',
+                                           'completed', 'workers', 'subtasks',
+                                           'timeframe', 'owner',
+                                           'subtasks_executed',
+                                           'executed_count'])):
+    '''
+    The state of a Task at one point in time.
+    
+    Records are immutable (workers and subtasks_executed are tuples), so the 
+    record collected at one timestamp can't change when the task does, and 
+    the same record can be shared by every state that includes it.
+    '''
+    
+    __slots__ = ()
+    
+    def to_record(self):
+        '''
+        The record itself; records are already immutable, so archived tasks
+        (see TaskArchive.get()) can be collected like live ones.
+        '''
+        return self
+    
+    def to_dict(self):
+        '''
+        Return the record as a dictionary, e.g. for json output.
+        '''
+        return dict(self._asdict())
+    
+    @classmethod
+    def from_dict(cls, data):
+        '''
+        Build a record from a dictionary like the ones to_dict() returns.
+        '''
+        data = dict(data)
+        data["workers"] = tuple(data["workers"])
+        data["subtasks_executed"] = tuple(data["subtasks_executed"])
+        return cls(**data)
+
+
+class TaskArchive(object):
+    '''
+    Compact, columnar storage for completed tasks.
+    
+    When task archival is on, the World moves each task here once it is
+    completed, so that only live tasks remain in its tasks dictionary. Each 
+    attribute is kept in a typed array indexed by task_id, and the workers of
+    all tasks are kept in one flat array, with each task's workers at
+    worker_ids[worker_start[task_id]:worker_start[task_id] + worker_count[task_id]].
+    
+    Attributes:
+        owner, payoff, subtasks, timeframe, executed_count: Typed arrays of
+            the corresponding attribute of each task. Task ids that have not 
+            been archived have owner -1.
+        worker_ids: Flat array of the workers of every archived task.
+        worker_start, worker_count: Where each task's workers are.
+        size: Number of tasks archived.
+    '''
+    
+    def __init__(self):
+        self.owner = array('l')
+        self.payoff = array('d')
+        self.subtasks = array('l')
+        self.timeframe = array('d')
+        self.executed_count = array('l')
+        self.worker_ids = array('l')
+        self.worker_start = array('l')
+        self.worker_count = array('l')
+        self.size = 0
+    
+    def _ensure(self, task_id):
+        '''
+        Extend the arrays to have a slot for the given task_id.
+        '''
+        missing = task_id + 1 - len(self.owner)
+        if missing > 0:
+            self.owner.extend([-1] * missing)
+            for column in [self.payoff, self.subtasks, self.timeframe,
+                           self.executed_count, self.worker_start, 
+                           self.worker_count]:
+                column.extend([0] * missing)
+    
+    def add(self, task):
+        '''
+        Archive a task.
+        '''
+        task_id = task.task_id
+        self._ensure(task_id)
+        self.owner[task_id] = task.owner
+        self.payoff[task_id] = task.payoff
+        self.subtasks[task_id] = task.subtasks
+        self.timeframe[task_id] = task.timeframe
+        self.executed_count[task_id] = task.executed_count
+        self.worker_start[task_id] = len(self.worker_ids)
+        self.worker_count[task_id] = len(task.workers)
+        self.worker_ids.extend(task.workers)
+        self.size += 1
+    
+    def get_workers(self, task_id):
+        start = self.worker_start[task_id]
+        return self.worker_ids[start:start + self.worker_count[task_id]].tolist()
+    
+    def get(self, task_id):
+        '''
+        Get a read-only TaskRecord of an archived task.
         
+        The archive doesn't keep subtasks_executed, which no longer matters
+        once a task is completed; the record has it empty.
         
-        
\ No newline at end of file
+        Returns:
+            The TaskRecord, or None if the task_id is not archived.
+        '''
+        if task_id not in self:
+            return None
+        return TaskRecord(task_id, False, self.payoff[task_id], True,
+                          tuple(self.get_workers(task_id)),
+                          self.subtasks[task_id], self.timeframe[task_id],
+                          self.owner[task_id], (),
+                          self.executed_count[task_id])
+    
+    def __contains__(self, task_id):
+        return 0 <= task_id < len(self.owner) and self.owner[task_id] != -1
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+        '''
+        Iterate over the archived task ids.
+        '''
+        for task_id, owner in enumerate(self.owner):
+            if owner != -1:
+                yield task_id
+
+
+class TaskNetwork(object):
+    '''
+    The network of who has worked on whose tasks, kept up to date as the work
+    is done.
+    
+    Each (worker, owner) edge is weighted by the number of times the worker
+    has been added to the workers of one of the owner's tasks; owners are 
+    added to their own task's workers when they complete it, so the network
+    also has owner-to-owner self-loops.
+    
+    Attributes:
+        weights: Dictionary mapping (worker, owner) edges to their weights.
+    '''
+    
+    def __init__(self):
+        self.weights = {}
+    
+    def add_work(self, worker, owner):
+        '''
+        Count one more piece of work by the worker on the owner's tasks.
+        '''
+        edge = (worker, owner)
+        self.weights[edge] = self.weights.get(edge, 0) + 1
+    
+    def edges(self):
+        '''
+        Iterate over the edges as (worker, owner, weight) tuples.
+        '''
+        for (worker, owner), weight in self.weights.iteritems():
+            yield worker, owner, weight
+    
+    def __len__(self):
+        return len(self.weights)
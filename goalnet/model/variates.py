@@ -0,0 +1,72 @@
+'''
+GoalNet Random Variates
+=======================
+
+Pre-drawn blocks of the random variates the model consumes one at a time.
+
+@author: dmasad
+'''
+
+from __future__ import division
+
+import numpy as np
+
+class RandomVariates(object):
+    '''
+    Serves scalar random variates out of blocks drawn with vectorized NumPy
+    calls.
+
+    Drawing one variate at a time costs far more in NumPy call overhead than
+    in the arithmetic, so each distribution keeps a buffer that is refilled
+    with block_size draws whenever it runs out. All blocks come from the same
+    seeded generator, so a run is reproducible from the seed alone.
+
+    Attributes:
+        random_state: The numpy RandomState all blocks are drawn from.
+        block_size: How many variates to draw per refill.
+        buffers: Dictionary mapping (distribution, params...) to a list of
+            variates not yet served, with the next one at the end.
+    '''
+
+    def __init__(self, seed=None, block_size=4096):
+        '''
+        Create a new variate service.
+
+        Args:
+            seed: Seed for the underlying RandomState.
+            block_size: Number of variates to draw at a time.
+        '''
+        self.random_state = np.random.RandomState(seed)
+        self.block_size = block_size
+        self.buffers = {}
+
+    def _next(self, distribution, *params):
+        '''
+        Serve the next variate from the given RandomState distribution,
+        refilling its buffer if needed.
+        '''
+        key = (distribution,) + params
+        try:
+            return self.buffers[key].pop()
+        except (KeyError, IndexError):
+            draw = getattr(self.random_state, distribution)
+            values = draw(*params, size=self.block_size).tolist()
+            values.reverse()
+            self.buffers[key] = values
+            return values.pop()
+
+    def exponential(self, speed=1):
+        '''
+        An exponential interval with rate speed; equivalent to
+        (-1/speed)*ln(U[0,1])
+        '''
+        return self._next('standard_exponential') / speed
+
+    def lognormal(self, mean, sigma):
+        return self._next('lognormal', mean, sigma)
+
+    def normal(self):
+        '''
+        A standard normal variate.
+        '''
+        return self._next('standard_normal')
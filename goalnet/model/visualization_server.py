@@ -10,7 +10,6 @@ import tornado.web
 import tornado.websocket
 import tornado.ioloop
 
-import networkx as nx
 from networkx.readwrite import json_graph
 
 from world import World
@@ -116,24 +115,6 @@ Task Assignment Speed <input type="text" id="taskSpeed"> <br />
 
 '''
 
-# ================ #
-#   HELPER FUNCS   #
-# ================ #
-
-def compare_graphs(G_old, G_new):
-    '''
-    Return a graph with only edges that are only new in G_new.
-    '''
-
-    G_out = nx.DiGraph()
-    for src, dest in G_new.edges():
-        if src not in G_old or dest not in G_old[src]:
-            G_out.add_edge(src, dest)
-    return G_out
-
-
-
-
 # ================ #
 #   SERVER CLASS   #
 # ================ #
@@ -155,7 +136,7 @@ class ModelSocket(tornado.websocket.WebSocketHandler):
         '''
         Launch the model with the given config dictionary.
         '''
-        self.last_network = None
+        self.sent_links = set()
         self.model = World(config)
         self.model.init_schedules()
         self.initialize_visualization()
@@ -195,7 +176,7 @@ class ModelSocket(tornado.websocket.WebSocketHandler):
         '''
         Send the nodes only.
         '''
-        data = json_graph.node_link_data(self.model.network)
+        data = json_graph.node_link_data(self.model.network.to_networkx())
         data['clock'] = 0
         self.write_message(data)
 
@@ -204,22 +185,20 @@ class ModelSocket(tornado.websocket.WebSocketHandler):
         '''
         Send the updates to the task network to the browser.
         '''
-        full_data = self.model.data_collector.data[self.model.clock]
-        
-
-        if "task_network" not in full_data:
+        # Only send updates at data collection points
+        if self.model.clock != self.model.data_collector.last_timestamp:
             return None
 
-        task_network = full_data["task_network"]
-        if self.last_network is not None:
-            out_graph = compare_graphs(self.last_network, task_network)
-        else:
-            out_graph = task_network
-        self.last_network = task_network
-
-        #data = json_graph.node_link_data(task_network)
-        data = json_graph.node_link_data(out_graph)
-        data = {'links': data["links"], 'clock': self.model.clock}
+        # The browser only needs the links that are new since the last update;
+        # those are among the task network edges changed since the last
+        # data collection.
+        links = []
+        delta = self.model.data_collector.last_delta
+        for worker, owner, weight in delta["task_network"]:
+            if (worker, owner) not in self.sent_links:
+                self.sent_links.add((worker, owner))
+                links.append({"source": worker, "target": owner})
+        data = {'links': links, 'clock': self.model.clock}
         self.write_message(data)
 
         #self.run_model() # Go back to running the model.
@@ -0,0 +1,125 @@
+'''
+GoalNet Willingness-to-Help Engine
+==================================
+
+@author: dmasad, snayar
+'''
+
+from __future__ import division
+
+import numpy as np
+
+class WillingnessToHelp(object):
+    '''
+    Evaluates the discounted interaction sums an agent's Willingness to Help
+    is computed from, over the agent's HistoryLog.
+
+    Each history event (neighbor, value, timestamp) contributes
+        value / (clock - timestamp)**beta
+    to the sum for its neighbor at a given clock. An agent asks for these sums
+    several times per activation (once per possible task and once per task
+    contributor), always at the same clock; so all the per-neighbor sums and
+    their total are computed at once, with vectorized operations over the
+    history arrays, and cached until the clock moves on or a new event is
+    recorded. Once computed, each interactions() lookup is O(1).
+
+    Unlike an exponential discount, the power-law discount of an event
+    can't be carried forward from one clock to the next by a common factor,
+    so the sums can't be maintained incrementally as events are recorded:
+    each new clock costs one pass over the stored history. Setting horizon
+    or min_weight is what keeps that pass short on long runs.
+
+    While evaluating, events older than horizon clock ticks, or whose
+    discounted weight has fallen below min_weight, are evicted from the
+    history. Since each term only shrinks as the clock advances, the evicted
+    events can only change an interaction sum by at most error_bound(clock).
+
+    Attributes:
+        history: The agent's HistoryLog.
+        beta: The discount factor on past events.
+        horizon: Maximum age of an event to keep; None to keep all events.
+        min_weight: Minimum absolute discounted weight of an event to keep;
+            None to keep all events.
+    '''
+
+    def __init__(self, history, beta, horizon=None, min_weight=None):
+        '''
+        Create a new engine.
+
+        Args:
+            history: The HistoryLog to keep history events in.
+            beta: The discount factor on past events.
+            horizon: Optional maximum event age to keep.
+            min_weight: Optional minimum discounted event weight to keep.
+        '''
+        self.history = history
+        self.beta = beta
+        self.horizon = horizon
+        self.min_weight = min_weight
+
+        self._clock = None
+        self._sums = np.zeros(0)
+        self._total = 0.0
+
+    def record(self, neighbor, value, timestamp):
+        '''
+        Add an event to the history.
+        '''
+        self.history.append(neighbor, value, timestamp)
+        self._clock = None
+
+    def _evaluate(self, clock):
+        '''
+        Compute the discounted sum of interactions with each neighbor, and in
+        total, at the given clock.
+        '''
+        neighbors, values, timestamps = self.history.columns()
+        weights = values / (clock - timestamps)**self.beta
+
+        # Evict events that no longer matter
+        drop = None
+        if self.horizon is not None:
+            drop = timestamps < clock - self.horizon
+        if self.min_weight is not None:
+            small = np.abs(weights) < self.min_weight
+            drop = small if drop is None else drop | small
+        if drop is not None and drop.any():
+            keep = ~drop
+            neighbors = neighbors[keep]
+            weights = weights[keep]
+            self.history.evict(drop)
+
+        self._clock = clock
+        # Neighbor ids are agent ids, so they index the sums directly.
+        if len(weights) > 0:
+            self._sums = np.bincount(neighbors, weights)
+        else:
+            self._sums = np.zeros(0)
+        self._total = float(weights.sum())
+
+    def interactions(self, neighbor, clock):
+        '''
+        Get the discounted interactions with a neighbor, and with everyone
+        else, at the given clock.
+
+        Returns:
+            A (neighbor_interactions, other_interactions) tuple.
+        '''
+        if clock != self._clock:
+            self._evaluate(clock)
+        if neighbor < len(self._sums):
+            neighbor_interactions = float(self._sums[neighbor])
+        else:
+            neighbor_interactions = 0
+        return neighbor_interactions, self._total - neighbor_interactions
+
+    def error_bound(self, clock):
+        '''
+        Upper bound on the absolute error that evicting old events introduces
+        into either interaction sum at the given clock.
+
+        This covers the horizon and min_weight evictions; with a history
+        capacity, see the history's overwrite_bound() for what the capacity
+        drops.
+        '''
+        return self.history.error_bound(clock, self.beta)
@@ -9,18 +9,31 @@ GoalNet World Class
 from __future__ import division
 
 # Standard library imports
+import cPickle
 import random
-from heapq import heappush, heappop
 from math import log
 
 # Other packages
 import numpy as np
-import networkx as nx
 
 # Model imports
 from agent import Agent
-from task import Task
+from adjacency import Adjacency
+from agent_state import AgentState, ColumnarAgent
+from task import Task, TaskArchive, TaskNetwork
 from datacollector import DataCollector
+from indexed_set import IndexedSet
+from scheduler import Scheduler, FixedInterval, ExponentialInterval
+from scheduler import AGENT_ACTIVATION, TASK_CREATION, DATA_COLLECTION
+from scheduler import CHECKPOINT
+from checkpoint import save_checkpoint
+from random_streams import RandomStreams
+
+# Config keys a branch can override, and the attributes they set
+BRANCH_OVERRIDES = {"agent_speed": "agent_speed",
+                    "task_speed": "task_speed",
+                    "collection_intervals": "data_collection_freq",
+                    "max_clock": "max_clock"}
 
 class World(object):
     '''
@@ -36,13 +49,38 @@ class World(object):
         Data Structures
         ---------------
         agents: A dictionary of agent objects
-        network: The networkx Graph object that represents the connections 
-        tasks: A dictionary of tasks.
+        agent_state: The AgentState holding the agents' numeric attributes,
+            or None if each Agent holds its own
+        agent_ids: A list of all agent ids, for drawing agents at random
+        idle_agents: IndexedSet of the ids of agents without a task
+        network: The Adjacency object that represents the connections; use
+            network.to_networkx() for a networkx Graph
+        tasks: A dictionary of tasks. With task archival on, completed tasks
+            are moved out of it into task_archive.
+        active_tasks: A dictionary of the tasks not yet completed.
+        completed_task_ids: A list of the ids of completed tasks, in order of
+            completion.
+        task_count: The number of tasks created so far.
+        task_archive: The TaskArchive holding completed tasks, or None if
+            task archival is off.
+        task_network: The TaskNetwork of which agents have worked on whose
+            tasks.
         
         Scheduling
         ----------
-        queue: A queue of functions to call
+        scheduler: The Scheduler holding the queue of upcoming events
         clock: The current timestamp of the model clock.
+        
+        Randomness
+        ----------
+        random_streams: The RandomStreams all of the run's random numbers
+            come from, seeded from random_seed.
+        random_number_generator: random.Random for the agents: their 
+            initial attributes and network, and all their decisions.
+        task_random, task_variates: Generators for picking task owners
+            and drawing the tasks' subtasks and payoffs.
+        schedule_variates: RandomVariates for the agent activation and 
+            task creation intervals.
         agent_speed: The mean interval of agent activation
         task_speed: The mean interval of task generation
         
@@ -51,18 +89,20 @@ class World(object):
     NOTES
     -----
     Scheduling model:
-        The model proceeds in terms of 'events', which are simply function
-        calls; primarily agent activations and task generation/assignment.
-        Each event is associated with a timestamp on the abstracted model clock.
+        The model proceeds in terms of 'events': agent activations, task
+        generation/assignment and data collection. Each event is associated
+        with a timestamp on the abstracted model clock.
         Events are called in order of their timestamps, while the model's clock
         is set to the timestamp of the most recent event. For example, if the
         event queue was [(1, A), (1.5, B), (2.1 C)] then event A would occur
-        at time 1, event B at time 1.5 and event C at time 2.1.
-        
-        Once an event occurs, it is immediately rescheduled; for example, an
-        agent will be activated, and the model will assign a timestamp for that
-        agent's next activation. The intervals between activations are drawn 
-        from a Poisson-like log-uniform distribution, scaled by a speed factor;
+        at time 1, event B at time 1.5 and event C at time 2.1. Events with
+        the same timestamp occur in the order they were scheduled.
+        
+        Once an event occurs, it is immediately rescheduled according to the
+        policy for its kind; for example, an agent will be activated, and the
+        model will assign a timestamp for that agent's next activation. The
+        intervals between activations are drawn from a Poisson-like
+        log-uniform distribution, scaled by a speed factor;
         the higher the speed, the smaller the intervals between occurances.
         
         More formally, let us say that event j will occur at times 
@@ -80,7 +120,9 @@ class World(object):
         Args:
         config: A dictionary containing all (or some of) the model
         configuration parameters, as follows:
-            "random_seed": A random seed, for replication purposes
+            "random_seed": A random seed, for replication purposes. If 
+                not given, one is drawn and recorded in the config, so that 
+                any run can be repeated from its config alone.
             "agent_count": How many agents to initiate the model with
             "initial_configuration": How to start off the network
                 "None": No connections between agents (default)
@@ -89,19 +131,68 @@ class World(object):
             "task_speed": How often new tasks are assigned; defaults to 1
             "max_clock": The maximum clock tick to run until
             "collection_intervals": Frequency of data collection; defaults to 1
+            "columnar_agents": If True, keep the agents' wealth and turns
+                in a columnar AgentState store; defaults to False
+            "wth_horizon": Maximum age of the history events agents keep for
+                computing Willingness to Help; defaults to None (keep all)
+            "history_capacity": Maximum number of history events each agent
+                keeps, dropping the oldest first; defaults to None (no limit)
+            "history_min_weight": Drop history events once their discounted
+                weight falls below this; defaults to None (keep all)
+            "stream_output": If True, write collected data to disk as it is
+                collected instead of keeping it in memory; defaults to False
+            "output_format": How export() writes the collected data: "json"
+                (data.json), "arrays" (a directory of .npy arrays) or "both";
+                defaults to "json"
+            "run_id": Name of the run's output directory; defaults to a 
+                random uuid
+            "archive_tasks": If True, move completed tasks out of the tasks 
+                dictionary into a compact TaskArchive; work done on a task 
+                after it is archived is not added to its workers, though it
+                still counts in the task network. Defaults to False
+            "checkpoint_interval": Save a checkpoint of the whole world to
+                the output directory every this many clock ticks; defaults
+                to None (no checkpoints)
         '''
         self.config = config
         #set the agent count from the config file
         self.agent_count = config["agent_count"]
         
         #Use the random seed from config file if available
-        if "random_seed" in config:
-            self.random_number_generator = random.Random(config["random_seed"])
-        else:
-            self.random_number_generator = random.Random()
-            self.config["random_seed"] = "None"
+        if "random_seed" not in config or config["random_seed"] == "None":
+            seed = random.SystemRandom().randint(0, 2**32 - 1)
+            self.config["random_seed"] = seed
+        
+        self._bind_random_streams(RandomStreams(self.config["random_seed"]))
             
-        self.network = nx.Graph()
+        self.network = Adjacency()
+        
+        #initialize the data collector, which tracks changes from the start
+        self.data_collector = DataCollector(self)
+        
+        #set how far back agents remember their interactions
+        self.wth_horizon = None
+        if "wth_horizon" in config and config["wth_horizon"] != "None":
+            self.wth_horizon = config["wth_horizon"]
+        else: self.config["wth_horizon"] = "None"
+        
+        self.history_capacity = None
+        if "history_capacity" in config and config["history_capacity"] != "None":
+            self.history_capacity = config["history_capacity"]
+        else: self.config["history_capacity"] = "None"
+        
+        self.history_min_weight = None
+        if "history_min_weight" in config and config["history_min_weight"] != "None":
+            self.history_min_weight = config["history_min_weight"]
+        else: self.config["history_min_weight"] = "None"
+        
+        #optionally store the agents' numeric attributes in columns
+        self.agent_state = None
+        agent_class = Agent
+        if config.get("columnar_agents", False):
+            self.agent_state = AgentState(self.agent_count)
+            agent_class = ColumnarAgent
+        else: self.config["columnar_agents"] = False
         
         #initialize the agents
         self.agents = {}
@@ -111,12 +202,12 @@ class World(object):
             pth = self.random_number_generator.random()
             cent = self.random_number_generator.random()
             greed = self.random_number_generator.random()
-            self.agents[agent_id] = Agent(agent_id, self, pth, cent, greed)
+            self.agents[agent_id] = agent_class(agent_id, self, pth, cent, greed)
+        self.agent_ids = list(self.agents)
+        self.idle_agents = IndexedSet(self.agents)
         
         if "initial_configuration" not in config or config["initial_configuration"] == "None":
             self.config["initial_configuration"] = "None"
-            for agent_id in self.agents:
-                self.network.add_node(agent_id)
         elif config["initial_configuration"] == "Random1":
             for agent_id in self.agents:
                 self.random_new_neighbor(agent_id)
@@ -141,52 +232,197 @@ class World(object):
         else:
             self.config["collection_intervals"] = self.data_collection_freq 
         
+        #set whether to stream collected data to disk
+        if "stream_output" not in config:
+            self.config["stream_output"] = False
+        
+        #set the format to export collected data in
+        if "output_format" not in config:
+            self.config["output_format"] = "json"
+        
         #set the maximum clock for the runs
         self.max_clock = None 
         if "max_clock" in config:
             self.max_clock = config["max_clock"]
         else: self.config["max_clock"] = "None"
-            
-        #initialize the data collector
-        self.data_collector = DataCollector(self)
+        
+        #set how often to save a checkpoint
+        self.checkpoint_interval = None
+        if "checkpoint_interval" in config and config["checkpoint_interval"] != "None":
+            self.checkpoint_interval = config["checkpoint_interval"]
+        else: self.config["checkpoint_interval"] = "None"
+        self.checkpoint_due = False
         
         self.clock = 0
-        self.queue = []
+        self.scheduler = Scheduler()
+        self._register_events()
         
         self.tasks = {}
+        self.active_tasks = {}
+        self.completed_task_ids = []
+        self.task_count = 0
+        self.task_network = TaskNetwork()
+        
+        #optionally archive completed tasks
+        self.task_archive = None
+        if config.get("archive_tasks", False):
+            self.task_archive = TaskArchive()
+        else: self.config["archive_tasks"] = False
             
     
-    def _add_event(self, event, timestamp):
+    def _bind_random_streams(self, random_streams):
+        '''
+        Draw all random numbers from the given streams from now on.
+        
+        The agents, task generation and scheduling get separate streams, so
+        that each one's draws don't shift the others'.
+        '''
+        self.random_streams = random_streams
+        self.random_number_generator = random_streams.get("agents").random
+        task_stream = random_streams.get("tasks")
+        self.task_random = task_stream.random
+        self.task_variates = task_stream.variates
+        self.schedule_variates = random_streams.get("scheduling").variates
+    
+    def _register_events(self):
+        '''
+        Register the handler and rescheduling policy for each event kind.
+        '''
+        self.scheduler.register(AGENT_ACTIVATION, self._activate_agent,
+                                ExponentialInterval(self.agent_speed,
+                                                    self.schedule_variates))
+        self.scheduler.register(TASK_CREATION, self._create_task,
+                                ExponentialInterval(self.task_speed,
+                                                    self.schedule_variates))
+        self.scheduler.register(DATA_COLLECTION, self._collect_data,
+                                FixedInterval(self.data_collection_freq))
+        if self.checkpoint_interval is not None:
+            self.scheduler.register(CHECKPOINT, self._checkpoint,
+                                    FixedInterval(self.checkpoint_interval))
+    
+    def _activate_agent(self, event):
+        self.agents[event.agent_id].activate()
+    
+    def _create_task(self, event):
+        self.create_task()
+    
+    def _checkpoint(self, event):
+        # Saved by tick() once the event has been rescheduled, so that the
+        # checkpoint has the full queue.
+        self.checkpoint_due = True
+    
+    def __setstate__(self, state):
+        '''
+        Restore a pickled World, and rebind the scheduler's event handlers.
+        '''
+        self.__dict__.update(state)
+        self._register_events()
+    
+    def branch_id(self, name):
         '''
-        Adds an event to the queue at the given timestamp.
+        The run_id of this world's branch with the given name.
+        '''
+        return str(self.data_collector.uuid) + "-" + name
+    
+    def branch(self, name, overrides=None, modifier=None, in_place=False):
+        '''
+        Branch off a new run from this world's current state.
+        
+        The branch is an exact copy of the world that continues with its own 
+        random number streams (spawned from this world's by name), its own
+        run_id (this run's, plus "-" and the name) and output directory, and
+        optionally some changed parameters. It keeps all the data collected 
+        so far, so its output covers the whole run, from before the branch 
+        point as well as after.
         
         Args:
-            event: A function to be called.
-            timestamp: The timestamp to call the event at.
+            name: Name of the branch; branches of the same world must have 
+                different names.
+            overrides: Optional dictionary of config values to change; only
+                the keys in BRANCH_OVERRIDES can be. Changed intervals take 
+                effect from the next time each event is rescheduled.
+            modifier: Optional function to call on the branch before it 
+                continues, e.g. to shock the agents' attributes.
+            in_place: If True, turn this world into the branch instead of
+                copying it; e.g. in a forked worker process, which already
+                has its own copy-on-write copy of the world.
+        
+        Returns:
+            The branch World.
         '''
-        heappush(self.queue, (timestamp, event))
+        if overrides is None:
+            overrides = {}
+        for key in overrides:
+            if key not in BRANCH_OVERRIDES:
+                raise ValueError("Can't override %s in a branch" % key)
+        
+        if in_place:
+            branch = self
+        else:
+            branch = cPickle.loads(cPickle.dumps(self, 
+                                                 cPickle.HIGHEST_PROTOCOL))
+        
+        branch.config = dict(branch.config)
+        branch.config.update(overrides)
+        branch.config["run_id"] = self.branch_id(name)
+        branch.config["parent_run_id"] = str(self.data_collector.uuid)
+        branch.config["branch"] = name
+        branch.config["branch_clock"] = branch.clock
+        for key, value in overrides.iteritems():
+            setattr(branch, BRANCH_OVERRIDES[key], value)
+        
+        branch._bind_random_streams(branch.random_streams.spawn(name))
+        branch._register_events()
+        branch.data_collector.branch(branch.config["run_id"])
+        if modifier is not None:
+            modifier(branch)
+        return branch
+    
+    def _collect_data(self, event):
+        self.data_collector.collect_all_data()
     
     def random_new_neighbor(self, name):
         '''
         Get the specified agent a new neighbor at random.
         
-        Updates the agent's network list and the overall network object. 
+        Updates the network. 
+        
+        The neighbor is drawn uniformly from the agents not yet connected to
+        this one. While at least half of all agents are eligible, this is done
+        by drawing random agents until one is eligible, which takes fewer than
+        two draws on average; only for nearly-saturated agents are the
+        eligible agents listed out.
         
         Args:
             name: The name of the agent for which the new neighbor is sought
         '''
-        #make a list of possible neighbors from agents not connected to this agent
-        possible_neighbors = [agent_id for agent_id in self.agents
-                              if agent_id != name and  
-                              not self.network.has_edge(agent_id, name)]
-        if possible_neighbors == []:
+        eligible_count = len(self.agent_ids) - 1 - self.network.degree(name)
+        if eligible_count <= 0:
             return None
         
-        #select an agent at random from the list of possible agents
-        neighbor = self.random_number_generator.choice(possible_neighbors)
-        self.agents[name].network.append(neighbor)
-        self.agents[neighbor].network.append(name)
-        self.network.add_edge(name, neighbor)
+        if 2 * eligible_count >= len(self.agent_ids):
+            # Rejection sampling against the adjacency index
+            while True:
+                neighbor = self.random_number_generator.choice(self.agent_ids)
+                if neighbor != name and not self.network.has_edge(name, neighbor):
+                    break
+        else:
+            #make a list of possible neighbors from agents not connected to this agent
+            neighbors = set(self.network.neighbors(name))
+            possible_neighbors = [agent_id for agent_id in self.agent_ids
+                                  if agent_id != name and  
+                                  agent_id not in neighbors]
+            #select an agent at random from the list of possible agents
+            neighbor = self.random_number_generator.choice(possible_neighbors)
+        
+        self.connect(name, neighbor)
+    
+    def connect(self, agent_1, agent_2):
+        '''
+        Add an edge between two agents to the network.
+        '''
+        self.network.add_edge(agent_1, agent_2)
+        self.data_collector.new_edges.append((agent_1, agent_2))
     
     def init_schedules(self, agent_delay = 0):
         '''
@@ -198,17 +434,16 @@ class World(object):
         '''
         
         #Schedule data collection:
-        self._add_event(self.data_collector.collect_all_data, 
-                        self.data_collection_freq)
+        self.scheduler.start(DATA_COLLECTION)
+        
+        if self.checkpoint_interval is not None:
+            self.scheduler.start(CHECKPOINT)
         
         # Schedule task creation
-        timestamp = (-1/self.task_speed) * np.log(self.random_number_generator.random())
-        self._add_event(self.create_task, timestamp)
+        self.scheduler.start(TASK_CREATION)
         
-        for agent in self.agents.values():
-            timestamp = (-1/self.agent_speed) * np.log(self.random_number_generator.random())
-            timestamp += agent_delay
-            self._add_event(agent.activate, timestamp)
+        for agent_id in self.agents:
+            self.scheduler.start(AGENT_ACTIVATION, agent_id, agent_delay)
         
     
     def create_task(self):
@@ -229,43 +464,94 @@ class World(object):
         
        
         # Find out if there are any agents available
-        available_agents = [agent for agent in self.agents 
-                                if self.agents[agent].task is None]
-        if available_agents == []:
+        if len(self.idle_agents) == 0:
             return None
         # Pick the task owner at random
-        owner = self.random_number_generator.choice(available_agents)
+        owner = self.idle_agents.choice(self.task_random)
         
         # Subtasks are drawn from an integer log-normal distribution
-        subtasks = np.random.lognormal(mean=1, sigma=0.8)
+        subtasks = self.task_variates.lognormal(1, 0.8)
         subtasks = int(np.ceil(subtasks))
         
         # Payoff is number of subtasks + an error
-        payoff_noise = np.random.randn()
+        payoff_noise = self.task_variates.normal()
         payoff = subtasks + payoff_noise
         if payoff <= 1:
             payoff = 1
         
         timeframe = self.agent_speed * 2 # Timeframe fixed for now.
-        task_id = len(self.tasks) + 1
+        self.task_count += 1
+        task_id = self.task_count
         
         #create the new task
         new_task = Task(task_id, payoff, subtasks, timeframe, owner)
         
         #Assign the new task
         self.agents[owner].task = new_task
+        self.idle_agents.discard(owner)
         self.tasks[task_id] = new_task
+        self.active_tasks[task_id] = new_task
+        self.task_changed(new_task)
+    
+    
+    def get_task(self, task_id):
+        '''
+        Get a task by id, whether it is live or archived.
+        
+        Archived tasks are returned as read-only TaskRecords.
+        '''
+        task = self.tasks.get(task_id)
+        if task is None and self.task_archive is not None:
+            task = self.task_archive.get(task_id)
+        return task
+    
+    
+    def complete_task(self, task):
+        '''
+        Mark a task as completed, and update the task indexes.
+        '''
+        task.completed = True
+        task.active = False
+        self.task_changed(task)
+        del self.active_tasks[task.task_id]
+        self.completed_task_ids.append(task.task_id)
+        if self.task_archive is not None:
+            del self.tasks[task.task_id]
+            self.task_archive.add(task)
+
+
+    def record_work(self, task, worker):
+        '''
+        Add a worker to a task's workers, and to the task network.
+        
+        Work on an archived task only counts in the task network.
+        '''
+        if task.task_id in self.tasks:
+            task.workers.append(worker)
+        self.task_network.add_work(worker, task.owner)
+        self.data_collector.changed_task_edges.add((worker, task.owner))
+    
+    
+    def task_changed(self, task):
+        '''
+        Note that a task has been created or changed, for data collection.
+        '''
+        self.data_collector.changed_tasks.add(task.task_id)
+    
+    
+    def wth_changed(self, name):
+        '''
+        Note that an agent has updated its willingness to help, for data
+        collection.
+        '''
+        self.data_collector.changed_wth.add(name)
 
 
     def completed_tasks(self):
         '''
         Count the number of completed tasks
         '''
-        count = 0
-        for task_id, task in self.tasks.iteritems():
-            if task.completed:
-                count += 1
-        return count
+        return len(self.completed_task_ids)
             
             
             
@@ -276,24 +562,17 @@ class World(object):
         
         Calls the next scheduled event, and advances the clock.
         '''
-        timestamp, event = heappop(self.queue)
-        self.clock = timestamp
+        event = self.scheduler.pop()
+        self.clock = event.timestamp
 
         if self.max_clock > 0 and self.clock > self.max_clock:
             return None # End if max time reached.
         
-        event()
-        # Reschedule events:
-        if event == self.data_collector.collect_all_data:
-            self._add_event(event, self.clock + self.data_collection_freq)
-            return True
-        
-        elif event == self.create_task:
-            speed = self.task_speed
-        else:
-            speed = self.agent_speed
-        delta = (-1/speed) * np.log(self.random_number_generator.random())
-        self._add_event(event, self.clock + delta)
+        # Call the event, and reschedule it:
+        self.scheduler.dispatch(event)
+        if self.checkpoint_due:
+            self.checkpoint_due = False
+            save_checkpoint(self)
         return True
     
          
@@ -313,7 +592,6 @@ if __name__ == "__main__":
               "max_clock": 100,
               "random_seed": 200}
     w = World(config)
-    np.random.seed(2)
     w.init_schedules()
     while w.tick() is not None:
         if w.clock % 10 == 0: print w.clock